@@ -0,0 +1,214 @@
+"""Command line interface for headless ICO conversion.
+
+Usage: python -m src [options] INPUT [INPUT ...]
+
+Inputs can be files, glob patterns, directories or zip/tar archives. With --watch, the input directories are watched
+and new images are converted as they land. Only modules without tkinter imports are used here, so the CLI also works
+on machines without a display.
+"""
+import os
+import sys
+import tempfile
+import argparse
+from dataclasses import replace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # Modules in this folder are imported flat
+
+from batch import ConvertJob, ConvertResult, convert_batch, job_outputs
+from ingest import iter_candidates
+from recipes import Recipe, find_sidecar, sidecar_path
+from ico_cache import IcoCache
+from frames import FRAME_STRATEGIES, parse_frame_selector
+
+
+def is_up_to_date(job):
+    """All outputs of job exist and are newer than the source, frame_samples jobs write one ICO per frame"""
+    try:
+        src_mtime = os.path.getmtime(job.src_path)
+        outputs = job_outputs(job)
+    except OSError:  # Unreadable source, the conversion reports it
+        return False
+    return all(os.path.exists(path) and os.path.getmtime(path) >= src_mtime for _, path in outputs)
+
+
+def frame_selector(value):
+    selector = parse_frame_selector(value)
+    if not isinstance(selector, int) and selector not in FRAME_STRATEGIES:
+        raise argparse.ArgumentTypeError(f"Frame must be an index or one of {', '.join(FRAME_STRATEGIES)}")
+    return selector
+
+
+def recipe_file(path):
+    try:
+        return Recipe.load(path)
+    except (OSError, ValueError, TypeError) as e:
+        raise argparse.ArgumentTypeError(f"Can not read recipe '{path}': {e}")
+
+
+def with_sharpen(recipe, sharpen):
+    """recipe with sharpening switched on if requested on the command line"""
+    return replace(recipe or Recipe(), sharpen=True) if sharpen else recipe
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(s) for s in value.split(",") if s.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Sizes must be comma separated integers, got '{value}'")
+    if not sizes or any(s < 1 or s > 256 for s in sizes):
+        raise argparse.ArgumentTypeError("Sizes must be between 1 and 256")
+    return sizes
+
+
+def print_slowest(results, n):
+    converted = [r for r in results if r.success and not r.cached]
+    print(f"Slowest {min(n, len(converted))} conversions:")
+    for result in sorted(converted, key=lambda r: r.duration, reverse=True)[:n]:
+        stages = ", ".join(f"{name.split('.')[-1]} {seconds * 1000:.1f}ms" for name, seconds in result.timings.items())
+        print(f"  {result.duration * 1000:8.1f}ms {result.job.src_path} ({stages})")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src", description="Convert images to multi-size ICO files.")
+    parser.add_argument("inputs", nargs="+", help="Image files, glob patterns, directories or zip/tar archives")
+    parser.add_argument("-s", "--sizes", type=parse_sizes, default=None,
+                        help="Comma separated icon sizes, e.g. 16,32,48,256 (default: 16 to 256)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument("-o", "--out-dir", default=None,
+                        help="Output directory, mirrors the input folders (default: next to each source)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    parser.add_argument("--include", action="append", default=None, metavar="GLOB",
+                        help="Only use files matching this pattern (file name or relative path), can be repeated")
+    parser.add_argument("--exclude", action="append", default=None, metavar="GLOB",
+                        help="Skip files matching this pattern, can be repeated")
+    parser.add_argument("-u", "--skip-up-to-date", action="store_true",
+                        help="Skip sources whose ICO exists and is newer than the source")
+    parser.add_argument("--frame", type=frame_selector, default=None,
+                        help="Frame of animated sources: an index, first, best_contrast or composite")
+    parser.add_argument("--frame-samples", type=int, default=None, metavar="N",
+                        help="Write one ICO per frame for N evenly sampled frames of each source")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="Losslessly shrink entries (palette BMPs for small sizes, optimized PNGs)")
+    parser.add_argument("--fit", action="store_true",
+                        help="Crop transparent or uniform borders and center the content on a square")
+    parser.add_argument("--sharpen", action="store_true",
+                        help="Sharpen the small sizes (up to 48px) and clean up their alpha edges")
+    parser.add_argument("--recipe", type=recipe_file, default=None, metavar="JSON",
+                        help="Apply this transform recipe to every source. Without it, a recipe sidecar saved next "
+                             "to an output (icon.recipe.json) is reused")
+    parser.add_argument("--max-mb", type=int, default=None,
+                        help="Memory budget per decoded source, larger sources are decoded at reduced scale or skipped")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Reuse ICOs of unchanged sources from this cache directory")
+    parser.add_argument("--cache-max-mb", type=int, default=512, help="Size limit of the cache (default: 512)")
+    parser.add_argument("--report-slowest", type=int, default=0, metavar="N",
+                        help="Print the N slowest conversions with their per-stage timings")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="Keep running and convert images as they land in the input directories. Outputs mirror "
+                             "the folder structure below --out-dir")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print errors")
+    return parser
+
+
+def print_result(result, quiet):
+    if not result.success:
+        print(f"Error converting {result.job.src_path}: {result.error}", file=sys.stderr)
+    elif not quiet:
+        source = "cache" if result.cached else f"{result.duration:.2f}s"
+        if result.bytes_saved:
+            source += f", {result.bytes_saved} bytes saved"
+        print(f"{result.job.src_path} -> {', '.join(result.outputs)} ({source})")
+
+
+def run_watch(args):
+    from watcher import watch  # Only needed in watch mode
+
+    roots = [item for item in args.inputs if os.path.isdir(item)]
+    if len(roots) != len(args.inputs):
+        print("Watch mode only accepts directories", file=sys.stderr)
+        return 1
+
+    if not args.quiet:
+        print(f"Watching {', '.join(roots)}, press Ctrl+C to stop")
+    try:
+        watch(roots, out_dir=args.out_dir, sizes=args.sizes, max_workers=max(1, args.jobs),
+              on_result=lambda result: print_result(result, args.quiet), cache_dir=args.cache_dir,
+              cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+              max_bytes=args.max_mb * 1024 * 1024 if args.max_mb else None, frame=args.frame,
+              frame_samples=args.frame_samples, optimize=args.optimize, recipe=with_sharpen(args.recipe, args.sharpen),
+              fit=args.fit)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.watch:
+        return run_watch(args)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+
+    max_bytes = args.max_mb * 1024 * 1024 if args.max_mb else None
+    with tempfile.TemporaryDirectory(prefix="ico_ingest_") as extract_dir:
+        candidates = iter_candidates(args.inputs, recursive=args.recursive, include=args.include,
+                                     exclude=args.exclude, extract_dir=extract_dir)
+        counts = {"found": 0, "jobs": 0, "bad_recipes": 0}
+
+        def iter_jobs():
+            """Jobs are created while the inputs are still being walked"""
+            for candidate in candidates:
+                counts["found"] += 1
+                # Mirrors the input folders below --out-dir, so equal names in different folders do not collide
+                job = ConvertJob(candidate.path, candidate.output_path(args.out_dir), sizes=args.sizes,
+                                 cache_dir=args.cache_dir, max_bytes=max_bytes, frame=args.frame,
+                                 frame_samples=args.frame_samples, optimize=args.optimize, fit=args.fit)
+                try:
+                    sidecar = None if args.recipe else find_sidecar(job.output_path)
+                except (OSError, ValueError, TypeError) as e:  # Report the source as failed, keep converting
+                    counts["jobs"] += 1
+                    counts["bad_recipes"] += 1
+                    error = f"Invalid recipe {sidecar_path(job.output_path)}: {e}"
+                    print_result(ConvertResult(job, False, error=error), args.quiet)
+                    continue
+                job.recipe = with_sharpen(args.recipe or sidecar, args.sharpen)
+                if args.skip_up_to_date and is_up_to_date(job):
+                    continue
+                os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+                counts["jobs"] += 1
+                yield job
+
+        failed = cached = saved = 0
+        results = []
+        for result in convert_batch(iter_jobs(), max_workers=max(1, args.jobs)):
+            results.append(result)
+            print_result(result, args.quiet)
+            if not result.success:
+                failed += 1
+            else:
+                cached += result.cached
+                saved += result.bytes_saved
+        failed += counts["bad_recipes"]
+
+    if not counts["found"]:
+        print("No valid images found", file=sys.stderr)
+        return 1
+
+    if args.cache_dir:
+        IcoCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024).evict()
+
+    if args.report_slowest:
+        print_slowest(results, args.report_slowest)
+
+    if not args.quiet:
+        print(f"{counts['jobs'] - failed - cached} converted, {cached} from cache, {failed} failed, "
+              f"{counts['found'] - counts['jobs']} up to date" + (f", {saved} bytes saved" if args.optimize else ""))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""asyncio facade over the batch engine, for services that must not block their event loop.
+
+    result = await convert_to_ico_async("logo.png", "logo.ico", sizes=[16, 32, 256])
+
+    async for result in convert_many(paths, out_dir="icons", max_in_flight=8):
+        print(result.job.output_path, result.success)
+
+Decoding, resizing and encoding run in an executor: the loop's default thread pool unless one is given. Pass a
+ProcessPoolExecutor for CPU heavy workloads, run_job and ConvertJob are picklable. Cancelling a call cancels the
+jobs that did not start yet. Jobs already running in a worker finish, but their results are dropped.
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import Executor
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Union
+from PIL import Image
+from utils import save_ico
+from batch import ConvertJob, ConvertResult, make_jobs, run_job
+
+Source = Union[str, os.PathLike, ConvertJob]
+
+
+def _convert_image(image: Image.Image, output_path, sizes: Optional[List[int]]) -> ConvertResult:
+    """Like run_job, but for an already loaded image"""
+    job = ConvertJob(src_path=getattr(image, "filename", ""), output_path=str(output_path), sizes=sizes)
+    start = time.perf_counter()
+    try:
+        save_ico(image, output_path, sizes=sizes)
+        return ConvertResult(job, True, duration=time.perf_counter() - start, outputs=[job.output_path])
+    except Exception as e:
+        return ConvertResult(job, False, error=f"{type(e).__name__}: {e}", duration=time.perf_counter() - start)
+
+
+async def convert_to_ico_async(source: Union[str, os.PathLike, Image.Image], output_path,
+                               sizes: Optional[List[int]] = None, executor: Optional[Executor] = None,
+                               **job_options) -> ConvertResult:
+    """Convert a file path or PIL image to an ICO without blocking the event loop.
+
+    Errors are reported in the result like with run_job, they are not raised. job_options are passed to the
+    ConvertJob of path sources (cache_dir, max_bytes, frame, optimize, ...).
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(source, Image.Image):
+        return await loop.run_in_executor(executor, _convert_image, source, output_path, sizes)
+    job = ConvertJob(src_path=os.fspath(source), output_path=os.fspath(output_path), sizes=sizes, **job_options)
+    return await loop.run_in_executor(executor, run_job, job)
+
+
+async def _iter_sources(sources: Union[Iterable[Source], AsyncIterable[Source]]) -> AsyncIterator[Source]:
+    if hasattr(sources, "__aiter__"):
+        async for source in sources:
+            yield source
+    else:
+        for source in sources:
+            yield source
+
+
+async def convert_many(sources: Union[Iterable[Source], AsyncIterable[Source]], out_dir: Optional[str] = None,
+                       sizes: Optional[List[int]] = None, executor: Optional[Executor] = None,
+                       max_in_flight: int = 8, **job_options) -> AsyncIterator[ConvertResult]:
+    """Convert paths or ConvertJobs concurrently, yielding results in completion order.
+
+    Sources are consumed lazily and at most max_in_flight jobs are submitted at a time, so a large or endless
+    source only takes new work when results are taken out. Paths get their output next to the source unless
+    out_dir is given. Leaving the loop early or cancelling the consuming task cancels all pending jobs.
+    """
+    if max_in_flight < 1:
+        raise ValueError("max_in_flight must be at least 1")
+
+    loop = asyncio.get_running_loop()
+    pending = set()
+    sources = _iter_sources(sources)
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    source = await sources.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                job = source if isinstance(source, ConvertJob) else \
+                    make_jobs([os.fspath(source)], out_dir=out_dir, sizes=sizes, **job_options)[0]
+                pending.add(asyncio.ensure_future(loop.run_in_executor(executor, run_job, job)))
+
+            if not pending:
+                return
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,75 @@
+"""Auto-fit: crop images to their content and pad them to a centered square.
+
+Content is everything that is not transparent or, for opaque images, differs from the background color found in
+the corners. The bounding box is searched on a reduced copy of at most ANALYSIS_SIZE pixels per edge and mapped
+back with a one pixel safety margin, so the analysis cost does not grow with the source resolution.
+"""
+import math
+from collections import Counter
+from typing import Optional, Tuple
+from PIL import Image, ImageChops
+
+ANALYSIS_SIZE = 256  # Longest edge of the copy the bounding box is searched on
+
+
+def _analysis_copy(img: Image.Image) -> Image.Image:
+    factor = max(1, max(img.size) // ANALYSIS_SIZE)
+    if img.mode in ("P", "1"):  # reduce() does not support these modes
+        img = img.convert("RGBA")
+    small = img.reduce(factor) if factor > 1 else img
+    return small.convert("RGBA") if small.mode != "RGBA" else small
+
+
+def content_bbox(img: Image.Image, tolerance: int = 8, use_background: bool = True
+                 ) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the content in img coordinates, None if the content fills the image or there is none.
+
+    Pixels with alpha above tolerance are content. If the image is fully opaque and use_background is set, pixels
+    differing from the most common corner color by more than tolerance in any channel are content.
+    """
+    small = _analysis_copy(img)
+    alpha = small.getchannel("A")
+
+    if alpha.getextrema()[0] < 255:
+        mask = alpha.point(lambda a: 255 if a > tolerance else 0)
+    elif use_background:
+        w, h = small.size
+        corners = [small.getpixel(xy) for xy in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+        background = Counter(corners).most_common(1)[0][0]
+        diff = ImageChops.difference(small.convert("RGB"), Image.new("RGB", small.size, background[:3]))
+        r, g, b = diff.split()
+        mask = ImageChops.lighter(ImageChops.lighter(r, g), b).point(lambda d: 255 if d > tolerance else 0)
+    else:
+        return None
+
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+
+    # Map back to full resolution, one extra analysis pixel per side covers content lost to the averaging
+    sx, sy = img.width / small.width, img.height / small.height
+    pad = 1 if small.size != img.size else 0
+    full = (max(0, math.floor((bbox[0] - pad) * sx)), max(0, math.floor((bbox[1] - pad) * sy)),
+            min(img.width, math.ceil((bbox[2] + pad) * sx)), min(img.height, math.ceil((bbox[3] + pad) * sy)))
+    return None if full == (0, 0, img.width, img.height) else full
+
+
+def pad_to_square(img: Image.Image, margin: float = 0.0, fill=(0, 0, 0, 0)) -> Image.Image:
+    """Center img on a square RGBA canvas. margin adds that fraction of the longest edge on every side."""
+    img = img.convert("RGBA") if img.mode != "RGBA" else img
+    side = max(img.size)
+    side += 2 * round(side * margin)
+    if img.size == (side, side):
+        return img
+
+    canvas = Image.new("RGBA", (side, side), fill)
+    canvas.paste(img, ((side - img.width) // 2, (side - img.height) // 2))
+    return canvas
+
+
+def auto_fit(img: Image.Image, margin: float = 0.0, tolerance: int = 8, use_background: bool = True) -> Image.Image:
+    """Crop img to its content and pad it symmetrically to a square"""
+    bbox = content_bbox(img, tolerance=tolerance, use_background=use_background)
+    if bbox is not None:
+        img = img.crop(bbox)
+    return pad_to_square(img, margin=margin)
@@ -0,0 +1,239 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Optional, List, Iterable, Iterator, Dict, Tuple, Union
+from PIL import Image
+from utils import save_ico, load_img_bounded, iter_frames_bounded, COMMON_SIZES, MAX_ICO_SIZE
+from ico_cache import IcoCache
+from profiling import EventRecorder, add_listener, remove_listener
+from frames import FrameSelector, frame_count, frame_output_path, sample_frame_indices
+from ico_writer import EncodeOptions
+from recipes import Recipe
+from sharpen import SHARPEN_VERSION
+
+
+@dataclass
+class ConvertJob:
+    src_path: str
+    output_path: str
+    sizes: Optional[List[int]] = None
+    cache_dir: Optional[str] = None  # Serve unchanged sources from an IcoCache in this directory
+    max_bytes: Optional[int] = None  # Memory budget for decoding the source, see load_img_bounded
+    frame: Optional[FrameSelector] = None  # Frame of animated sources, see frames.select_frame
+    frame_samples: Optional[int] = None  # Write one ICO per sampled frame instead of a single ICO
+    optimize: bool = False  # Losslessly shrink entries, see optimize.optimize_entry
+    recipe: Optional[Recipe] = None  # Transforms applied before converting, see recipes.Recipe
+    fit: bool = False  # Crop to the content and pad to a centered square, see autofit.auto_fit
+
+
+@dataclass
+class ConvertResult:
+    job: ConvertJob
+    success: bool
+    error: Optional[str] = None
+    duration: float = 0.0  # Seconds spent in the worker
+    cached: bool = False  # Output was copied from the cache instead of converted
+    timings: Dict[str, float] = field(default_factory=dict)  # Seconds per convert stage, see profiling
+    outputs: List[str] = field(default_factory=list)  # Written files, several for frame_samples jobs
+    bytes_saved: int = 0  # Bytes saved by the optimize pass
+
+
+def make_jobs(paths: Iterable[str], out_dir: Optional[str] = None, sizes: Optional[List[int]] = None,
+              cache_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+              frame: Optional[FrameSelector] = None, frame_samples: Optional[int] = None,
+              optimize: bool = False, recipe: Optional[Recipe] = None, fit: bool = False) -> List[ConvertJob]:
+    """Create one job per source path. The ICO is placed next to the source unless an output dir is given."""
+    jobs = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0] + ".ico"
+        target_dir = out_dir if out_dir else os.path.dirname(path)
+        jobs.append(ConvertJob(src_path=path, output_path=os.path.join(target_dir, name), sizes=sizes,
+                              cache_dir=cache_dir, max_bytes=max_bytes, frame=frame,
+                              frame_samples=frame_samples, optimize=optimize, recipe=recipe, fit=fit))
+    return jobs
+
+
+def job_outputs(job: ConvertJob) -> List[Tuple[Optional[FrameSelector], str]]:
+    """(frame, output path) of every ICO a job writes, one per sampled frame for frame_samples jobs"""
+    if not job.frame_samples:
+        return [(job.frame, job.output_path)]
+    with Image.open(job.src_path) as probe:  # Header only, frames are decoded by the conversion
+        indices = sample_frame_indices(frame_count(probe), job.frame_samples)
+    return [(index, frame_output_path(job.output_path, index)) for index in indices]
+
+
+def _save(job: ConvertJob, img: Image.Image, output_path: str):
+    src = job.recipe.apply(img, cropped=True) if job.recipe is not None else img
+    # img is the draft or reduced decode, so the auto-fit analysis never touches the full bitmap
+    save_ico(src, output_path, sizes=job.sizes, source=job.src_path,
+             encode_options=EncodeOptions(optimize=True) if job.optimize else None,
+             sharpen=job.recipe is not None and job.recipe.sharpen, fit=job.fit)
+
+
+def _convert(job: ConvertJob, targets: List[Tuple[Optional[FrameSelector], str]]):
+    """Decode and save the given (frame, output path) targets of job"""
+    target_size = min(max(job.sizes or COMMON_SIZES), MAX_ICO_SIZE)
+    crop_box = None
+    if job.recipe is not None and job.recipe.crop:
+        with Image.open(job.src_path) as probe:  # Header only, the pixel crop depends on the size
+            crop_box = job.recipe.crop_box(probe.size)
+
+    if not job.frame_samples:
+        (frame, output_path), = targets
+        with load_img_bounded(job.src_path, max_bytes=job.max_bytes, target_size=target_size,
+                              crop_box=crop_box, frame=frame) as img:
+            _save(job, img, output_path)
+        return
+
+    # All sampled frames in one forward pass, the decode cost scales with the highest index and not per frame
+    outputs = dict(targets)
+    for index, img in iter_frames_bounded(job.src_path, list(outputs), max_bytes=job.max_bytes,
+                                          target_size=target_size, crop_box=crop_box):
+        with img:
+            _save(job, img, outputs[index])
+
+
+def run_job(job: ConvertJob) -> ConvertResult:
+    """Convert a single job. Top level function so it can be sent to worker processes."""
+    start = time.perf_counter()
+    try:
+        targets = job_outputs(job)
+        keys = {}
+        if job.cache_dir:  # Checked before decoding, so a job that is fully cached decodes nothing
+            cache = IcoCache(job.cache_dir)
+            sharpen_version = SHARPEN_VERSION if job.recipe is not None and job.recipe.sharpen else None
+            for frame, output_path in targets:
+                # max_bytes sets the decode scale, so a tighter budget gives different pixels
+                keys[output_path] = cache.make_key(job.src_path, sizes=job.sizes, frame=frame, optimize=job.optimize,
+                                                   recipe=job.recipe, fit=job.fit, sharpen_version=sharpen_version,
+                                                   max_bytes=job.max_bytes)
+            missing = [(frame, path) for frame, path in targets if not cache.fetch(keys[path], path)]
+        else:
+            missing = targets
+        outputs = [path for _, path in targets]
+        if not missing:
+            return ConvertResult(job, True, duration=time.perf_counter() - start, cached=True, outputs=outputs)
+
+        recorder = EventRecorder(prefix="convert.")
+        add_listener(recorder)
+        try:
+            _convert(job, missing)
+        finally:
+            remove_listener(recorder)
+        # Other threads may convert at the same time, so only keep the stages of this source
+        recorder.events = [e for e in recorder.events if e.fields.get("source") == job.src_path]
+
+        if job.cache_dir:
+            for _, path in missing:
+                cache.store(keys[path], path)
+        bytes_saved = sum(e.fields["bytes_saved"] for e in recorder.events if e.name == "convert.optimized")
+        return ConvertResult(job, True, duration=time.perf_counter() - start, timings=recorder.totals(),
+                             outputs=outputs, bytes_saved=bytes_saved)
+    except Exception as e:
+        return ConvertResult(job, False, error=f"{type(e).__name__}: {e}", duration=time.perf_counter() - start)
+
+
+def _claim_outputs(jobs: Iterable[ConvertJob]) -> Iterator[Union[ConvertJob, ConvertResult]]:
+    """jobs, with a failed result in place of every job whose output an earlier job of the batch already writes.
+
+    Two workers writing the same file would race and silently keep one of the sources, e.g. x.png and x.jpg.
+    """
+    claimed = {}  # Normalized output path -> source
+    for job in jobs:
+        output = os.path.normcase(os.path.abspath(job.output_path))
+        if output in claimed:
+            yield ConvertResult(job, False, error=f"Output {job.output_path} is already written by {claimed[output]}")
+        else:
+            claimed[output] = job.src_path
+            yield job
+
+
+def convert_batch(jobs: Iterable[ConvertJob], max_workers: Optional[int] = None) -> Iterator[ConvertResult]:
+    """Convert all jobs across a process pool, yielding results in completion order.
+
+    jobs may be a lazy iterable, it is consumed while converting with a bounded number of jobs in flight. So the
+    first results arrive before a long input is fully enumerated. max_workers=1 runs the jobs in the calling
+    process, which avoids the pool start-up cost for small batches. A job whose output path is already used by an
+    earlier job fails without converting.
+    """
+    items = _claim_outputs(jobs)
+    head = list(islice(items, 2))
+
+    if max_workers == 1 or len(head) <= 1:
+        for item in chain(head, items):
+            yield item if isinstance(item, ConvertResult) else run_job(item)
+        return
+
+    items = chain(head, items)
+    window = 2 * (max_workers or os.cpu_count() or 1)  # Keeps the workers busy without queueing everything
+    # Spawned workers, forking from the GUI's worker thread can copy a lock held by another thread and deadlock
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = set()
+        try:
+            while True:
+                while len(pending) < window:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    if isinstance(item, ConvertResult):
+                        yield item
+                    else:
+                        pending.add(executor.submit(run_job, item))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:  # Only has an effect if the consumer stopped early
+                future.cancel()
+
+
+class BatchRunner:
+    """Runs convert_batch in a background thread so a GUI mainloop can poll for results without blocking."""
+
+    def __init__(self, jobs: Iterable[ConvertJob], max_workers: Optional[int] = None):
+        self.jobs = list(jobs)
+        self.max_workers = max_workers
+        self.results: List[ConvertResult] = []
+        self._result_queue = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop handing out results. Jobs already running in a worker still finish."""
+        self._cancelled.set()
+
+    @property
+    def done(self):
+        return not self._thread.is_alive() and self._result_queue.empty()
+
+    def poll(self) -> List[ConvertResult]:
+        """Return all results that arrived since the last call. Safe to call from the GUI thread."""
+        new_results = []
+        while True:
+            try:
+                new_results.append(self._result_queue.get_nowait())
+            except queue.Empty:
+                break
+        self.results.extend(new_results)
+        return new_results
+
+    def _run(self):
+        batch = convert_batch(self.jobs, max_workers=self.max_workers)
+        try:
+            for result in batch:
+                self._result_queue.put(result)
+                if self._cancelled.is_set():
+                    break
+        finally:
+            batch.close()
@@ -0,0 +1,178 @@
+"""Benchmarks for the conversion pipeline.
+
+Usage:
+    python bench.py --output results.json
+    python bench.py --baseline results.json --threshold 0.2
+
+Synthetic fixtures are generated in a temporary directory. Each stage is timed separately and the median of
+--repeat runs is reported. With --baseline the run fails (exit code 1) if a stage got slower, or peak memory grew,
+by more than the threshold fraction.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import statistics
+from PIL import Image
+import utils
+from utils import load_img, save_ico, create_checkerboard_pattern, map_crop_box
+
+# name: (size, mode)
+FIXTURES = {
+    "small_square_rgb": ((64, 64), "RGB"),
+    "large_square_rgba": ((2048, 2048), "RGBA"),
+    "large_wide_rgb": ((4000, 1500), "RGB"),
+    "large_tall_rgba": ((1200, 3600), "RGBA"),
+    "medium_p": ((800, 600), "P"),
+    "photo_jpeg": ((6000, 4000), "RGB"),
+    "animated_gif": ((400, 400), "P"),
+}
+
+
+def make_fixture(path, size, mode, frames=1):
+    base = Image.effect_mandelbrot(size, (-2.0, -1.2, 0.8, 1.2), 64)  # Deterministic detail, mode "L"
+    if mode == "RGBA":
+        img = Image.merge("RGBA", (base, base.rotate(90, expand=False), base.transpose(Image.FLIP_LEFT_RIGHT), base))
+    elif mode == "P":
+        img = Image.merge("RGB", (base, base, base.point(lambda v: 255 - v))).quantize(64)
+    else:
+        img = Image.merge("RGB", (base, base.point(lambda v: 255 - v), base))
+
+    if frames > 1:
+        sequence = [img.rotate(i * 360 / frames) for i in range(frames)]
+        sequence[0].save(path, save_all=True, append_images=sequence[1:], duration=40, loop=0)
+    else:
+        img.save(path)
+
+
+def create_fixtures(directory):
+    paths = {}
+    for name, (size, mode) in FIXTURES.items():
+        if name == "photo_jpeg":
+            ext = ".jpg"
+        elif name == "animated_gif":
+            ext = ".gif"
+        else:
+            ext = ".png"
+        paths[name] = os.path.join(directory, name + ext)
+        make_fixture(paths[name], size, mode, frames=24 if ext == ".gif" else 1)
+    return paths
+
+
+def time_stage(func, repeat):
+    """Median wall time of func in seconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, None where the resource module is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # Bytes on macOS, KB elsewhere
+
+
+def run_benchmarks(repeat=5):
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = create_fixtures(directory)
+
+        for name, path in fixtures.items():
+            stages[f"load_img.full.{name}"] = time_stage(lambda: load_img(path, set_size=None).load(), repeat)
+            stages[f"load_img.preview.{name}"] = time_stage(lambda: load_img(path, set_size=320), repeat)
+            stages[f"load_img.thumb.{name}"] = time_stage(lambda: load_img(path, set_size=48), repeat)
+
+            decoded = load_img(path, set_size=None)
+            decoded.load()
+            stages[f"convert_to_ico.{name}"] = time_stage(lambda: save_ico(decoded.copy(), io.BytesIO()), repeat)
+
+        def checkerboard():
+            utils._checkerboard.cache_clear()  # Time the generation, not the memoized lookup
+            create_checkerboard_pattern(320, 320)
+
+        stages["checkerboard.320"] = time_stage(checkerboard, repeat)
+
+        boxes = [(x, x, x + 100, x + 100) for x in range(0, 200, 2)]
+        sizes = [(64, 64), (4000, 1500), (1200, 3600), (6000, 4000)]
+        stages["crop_math.400"] = time_stage(
+            lambda: [map_crop_box(box, size, 320) for box in boxes for size in sizes], repeat)
+
+        # End to end throughput over all fixtures
+        convert_time = sum(v for k, v in stages.items() if k.startswith("convert_to_ico."))
+        throughput = len(fixtures) / convert_time if convert_time else None
+
+    return {
+        "python": platform.python_version(),
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "stages": stages,
+        "convert_throughput_per_s": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """List of human readable regressions of results compared to the baseline"""
+    regressions = []
+
+    for stage, seconds in results["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if base and seconds > base * (1 + threshold):
+            regressions.append(f"{stage}: {base * 1000:.2f}ms -> {seconds * 1000:.2f}ms")
+
+    base_rss, rss = baseline.get("peak_rss_mb"), results.get("peak_rss_mb")
+    if base_rss and rss and rss > base_rss * (1 + threshold):
+        regressions.append(f"peak_rss_mb: {base_rss:.1f} -> {rss:.1f}")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ICO conversion pipeline.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage, the median is reported")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed slowdown as a fraction of the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(repeat=args.repeat)
+
+    for stage, seconds in sorted(results["stages"].items()):
+        print(f"{stage:45s} {seconds * 1000:9.2f} ms")
+    print(f"{'convert throughput':45s} {results['convert_throughput_per_s']:9.2f} img/s")
+    if results["peak_rss_mb"] is not None:
+        print(f"{'peak rss':45s} {results['peak_rss_mb']:9.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions beyond threshold:")
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print("No regressions beyond threshold")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
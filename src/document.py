@@ -0,0 +1,81 @@
+from typing import Optional
+from PIL import Image
+from utils import load_img, load_img_bounded, estimate_decoded_bytes
+
+
+class ImageDocument:
+    """One source image shared by the preview, the info labels and the crop/save path.
+
+    Opening only reads the header. The full resolution bitmap is decoded on first access of `image` and kept until
+    close(), so the file is decoded at most once while it is displayed. Previews use the cheap reduced decode.
+    With max_bytes set, a larger JPEG is decoded at reduced scale, so `image` may have a lower resolution than
+    `size`. Other formats can not be decoded partially, for them `image` raises MemoryBudgetExceeded.
+    """
+
+    def __init__(self, path, max_bytes: Optional[int] = None):
+        self.path = path
+        self.max_bytes = max_bytes  # Memory budget of the full decode, see load_img_bounded
+        self._source: Optional[Image.Image] = None  # Header only until loaded
+        self._full: Optional[Image.Image] = None
+        self._previews = {}  # set_size -> preview image
+
+    def _open(self) -> Image.Image:
+        if self._source is None:
+            self._source = Image.open(self.path)
+        return self._source
+
+    @property
+    def size(self):
+        """Dimensions from the file header, does not decode pixel data"""
+        return self._open().size
+
+    @property
+    def format(self):
+        return self._open().format
+
+    @property
+    def is_decoded(self):
+        return self._full is not None
+
+    @property
+    def image(self) -> Image.Image:
+        """Full resolution image, decoded on first access. Callers must not modify it in place."""
+        if self._full is None:
+            source = self._open()
+            if self.max_bytes and estimate_decoded_bytes(source) > self.max_bytes:
+                self._full = load_img_bounded(self.path, max_bytes=self.max_bytes)
+            else:
+                source.load()
+                self._full = source
+        return self._full
+
+    def preview(self, set_size: int) -> Image.Image:
+        if set_size not in self._previews:
+            if self._full is not None:  # Already decoded, scaling down is cheaper than another decode
+                self._previews[set_size] = self._scaled(self._full, set_size)
+            else:
+                self._previews[set_size] = load_img(self.path, set_size=set_size)
+        return self._previews[set_size]
+
+    @staticmethod
+    def _scaled(img, set_size):
+        width, height = img.size
+        if height >= width:
+            new_size = (round((width / height) * set_size), set_size)
+        else:
+            new_size = (set_size, round((height / width) * set_size))
+        return img.resize(new_size)
+
+    def close(self):
+        """Release the decoded bitmaps and the file handle"""
+        if self._source is not None:
+            self._source.close()
+        self._source = None
+        self._full = None
+        self._previews.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
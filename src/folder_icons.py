@@ -0,0 +1,119 @@
+"""Batched folder icon deployment through desktop.ini files.
+
+All desktop.ini files are first written to temp files next to their target. Only when every one of them was
+prepared are they renamed into place, so a failure while preparing leaves no folder changed. Folders whose
+desktop.ini already has the wanted content are skipped. File attributes go through a backend, which is a no-op
+outside of Windows.
+"""
+import os
+import ctypes
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+FILE_ATTRIBUTE_READONLY = 0x01
+FILE_ATTRIBUTE_HIDDEN = 0x02
+FILE_ATTRIBUTE_SYSTEM = 0x04
+FILE_ATTRIBUTE_NORMAL = 0x80
+
+
+class AttributeBackend:
+    """Sets file attributes. This base class does nothing, which is all that is needed outside of Windows."""
+
+    def set_attributes(self, path, attributes: int):
+        pass
+
+
+class RecordingAttributeBackend(AttributeBackend):
+    """No-op backend that remembers the calls, to check the deployment logic on any OS"""
+
+    def __init__(self):
+        self.calls = []
+
+    def set_attributes(self, path, attributes: int):
+        self.calls.append((path, attributes))
+
+
+class WindowsAttributeBackend(AttributeBackend):
+    def set_attributes(self, path, attributes: int):
+        if not ctypes.windll.kernel32.SetFileAttributesW(str(path), attributes):
+            raise ctypes.WinError()
+
+
+def default_backend() -> AttributeBackend:
+    return WindowsAttributeBackend() if os.name == "nt" else AttributeBackend()
+
+
+def desktop_ini_content(icon_path) -> str:
+    return (f"[.ShellClassInfo]\n"
+            f"IconResource={icon_path},0\n"
+            f"IconFile=%SystemRoot%\\system32\\SHELL32.dll\n"
+            f"IconIndex=0\n")
+
+
+@dataclass
+class FolderIconResult:
+    folder: str
+    icon_path: str
+    status: str  # "written", "skipped" (already up to date) or "failed"
+    error: Optional[str] = None
+
+
+def _read_text(path) -> Optional[str]:
+    try:
+        with open(path, "r", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def deploy_folder_icons(mapping: Dict[str, str], backend: Optional[AttributeBackend] = None) -> List[FolderIconResult]:
+    """Set the icon of every folder in mapping (folder -> ico path) in one pass.
+
+    Returns one result per folder. If a desktop.ini can not be prepared, no folder is changed and all other folders
+    that needed a change are reported as failed too. Folders that are already up to date stay skipped.
+    """
+    backend = backend or default_backend()
+    results = {folder: FolderIconResult(folder, icon, "skipped") for folder, icon in mapping.items()}
+    staged = {}  # folder -> temp file with the new desktop.ini
+
+    # Compare every folder first, so an abort below never reports an up to date folder as failed
+    changed = {}  # folder -> new desktop.ini content
+    for folder, icon in mapping.items():
+        content = desktop_ini_content(icon)
+        if _read_text(os.path.join(folder, "desktop.ini")) != content:
+            changed[folder] = content
+
+    # Phase 1: write all temp files, nothing visible changes yet
+    try:
+        for folder, content in changed.items():
+            fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".desktop.ini.", suffix=".tmp")
+            staged[folder] = tmp_path
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+    except OSError as e:
+        for tmp_path in staged.values():
+            os.remove(tmp_path)
+        for changed_folder in changed:
+            results[changed_folder].status = "failed"
+            results[changed_folder].error = f"Batch aborted, {folder}: {e}"
+        return list(results.values())
+
+    # Phase 2: move the files into place and set the attributes
+    for folder, tmp_path in staged.items():
+        desktop_ini = os.path.join(folder, "desktop.ini")
+        result = results[folder]
+        try:
+            if os.path.exists(desktop_ini):
+                backend.set_attributes(desktop_ini, FILE_ATTRIBUTE_NORMAL)  # Hidden system files can not be replaced
+            os.replace(tmp_path, desktop_ini)
+            backend.set_attributes(desktop_ini, FILE_ATTRIBUTE_HIDDEN | FILE_ATTRIBUTE_SYSTEM)
+            backend.set_attributes(folder, FILE_ATTRIBUTE_READONLY)  # Makes Explorer read desktop.ini
+            result.status = "written"
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            result.status = "failed"
+            result.error = str(e)
+
+    return list(results.values())
@@ -0,0 +1,87 @@
+"""Frame selection for animated sources (GIF, WebP).
+
+Pillow decodes animation frames in order, so every function here visits the sampled frames in ascending order. The
+work then scales with the highest frame index used, and frames after it are never decoded.
+"""
+import os
+from typing import List, Union, Optional
+from PIL import Image, ImageStat
+
+FrameSelector = Union[str, int]  # "first", "best_contrast", "composite" or a frame index
+FRAME_STRATEGIES = ("first", "best_contrast", "composite")
+
+
+def frame_count(img: Image.Image) -> int:
+    return getattr(img, "n_frames", 1)
+
+
+def sample_frame_indices(n_frames: int, samples: int) -> List[int]:
+    """Evenly spaced frame indices, always including the first frame"""
+    if samples <= 1 or n_frames <= 1:
+        return [0]
+    if samples >= n_frames:
+        return list(range(n_frames))
+    step = n_frames / samples
+    return sorted({int(i * step) for i in range(samples)})
+
+
+def iter_frames(img: Image.Image, indices: List[int]):
+    """Yield (index, RGBA copy) for the given frames, seeking forward only"""
+    for index in sorted(set(indices)):
+        if index >= frame_count(img):
+            break
+        img.seek(index)
+        yield index, img.convert("RGBA")  # Copy, the next seek overwrites the frame buffer
+
+
+def contrast_score(frame: Image.Image) -> float:
+    """Luminance standard deviation of a small copy, weighted by coverage so empty frames lose"""
+    small = frame.copy()
+    small.thumbnail((64, 64), Image.BILINEAR)
+    luminance = ImageStat.Stat(small.convert("L")).stddev[0]
+    coverage = ImageStat.Stat(small.getchannel("A")).mean[0] / 255
+    return luminance * coverage
+
+
+def select_frame(img: Image.Image, frame: Optional[FrameSelector] = "first", samples: int = 8) -> Image.Image:
+    """Decode one frame of a possibly animated image as RGBA.
+
+    frame is a frame index, "first", "best_contrast" (highest contrast of the sampled frames) or "composite"
+    (average of the sampled frames). Only sampled frames are decoded, up to the highest sampled index.
+    """
+    if frame is None or frame == "first":
+        frame = 0
+
+    if isinstance(frame, int):
+        if not 0 <= frame < frame_count(img):
+            raise ValueError(f"Frame {frame} out of range, the image has {frame_count(img)} frames")
+        img.seek(frame)
+        return img.convert("RGBA")
+
+    indices = sample_frame_indices(frame_count(img), samples)
+
+    if frame == "best_contrast":
+        best, best_score = None, -1.0
+        for _, candidate in iter_frames(img, indices):
+            score = contrast_score(candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+        return best
+
+    if frame == "composite":
+        composite = None
+        for n, (_, candidate) in enumerate(iter_frames(img, indices)):
+            # Running average, the n-th frame gets weight 1/(n+1)
+            composite = candidate if composite is None else Image.blend(composite, candidate, 1 / (n + 1))
+        return composite
+
+    raise ValueError(f"Unknown frame selector '{frame}', use an index or one of {FRAME_STRATEGIES}")
+
+
+def parse_frame_selector(value: str) -> FrameSelector:
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def frame_output_path(output_path, index: int) -> str:
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_frame{index}{ext or '.ico'}"
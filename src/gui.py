@@ -7,18 +7,31 @@ from typing import Optional, Callable
 from utils import *
 from tk_elements import *
 from PIL import ImageTk
-import re
+import time
+import sqlite3
+from itertools import chain
 from tkinter.font import Font
 import os
-from collections import deque
+from image_queue import ImageQueue
 from styles import init_styles
 from tkinter import filedialog
+from batch import BatchRunner, make_jobs
+from thumbnails import ThumbnailService
+from document import ImageDocument
+from ingest import iter_candidates, parse_drop_data, is_ingestible
+from recipes import Recipe, sidecar_path
+from session import SessionStore, Session, ImageSettings
+from profiling import stage, emit, add_listener, print_listener
 
 
 class App(TkinterDnD.Tk):
     img_preview_size = 320
     img_queue_size = 50
-    valid_img_types = ("jpg", "jpeg", "png", "webp", "gif")
+    max_decode_bytes = 1024 * 1024 * 1024  # Larger JPEGs are decoded at reduced scale, other formats are not converted
+    ingest_slice = 0.02  # Seconds per mainloop tick spent discovering dropped images
+    session_save_delay = 1000  # Milliseconds after a queue change until the session is written
+    session_path = os.path.join(os.path.expanduser("~"), ".simple_ico_creator", "session.sqlite3")
+    valid_img_types = VALID_IMG_TYPES
     cols = {"dnd_border_base": "grey", "dnd_border_valid": "#8CCC29", "dnd_border_invalid": "indian red",
             "action_btn_base": "#90C67C", "action_btn_hover": "#67AE6E", "action_btn_press": "#328E6E"}
 
@@ -38,7 +51,9 @@ class App(TkinterDnD.Tk):
         self.left_wing_frame.pack(side="left", anchor="n", pady=10, padx=10, fill="y")
         self.left_wing_frame.pack_propagate(False)
 
-        self.queue_frame = tk.Frame(self.left_wing_frame, bg=self.left_wing_frame.cget("bg"), width=200)
+        self.queue_frame = QueueGrid(self.left_wing_frame, cell_size=App.img_queue_size, cols=4, rows=6,
+                                     cell_bg=App.cols["dnd_border_base"], on_clear=self.delete_queue,
+                                     bg=self.left_wing_frame.cget("bg"), width=200)
         self.queue_frame.pack(side="right", anchor="n")
 
         self.outer_dnd_frame = tk.Frame(self.content_frame, bg=self.content_frame.cget("bg"))
@@ -151,12 +166,88 @@ class App(TkinterDnD.Tk):
         """VARIABLES"""
 
         self.displayed_img = None  # Image currently in the main display
-        self.image_queue = deque()  # Images currently in the queue
-        self.queue_tk_img_obj = {}
+        self.displayed_doc = None  # ImageDocument of the displayed image
+        self.image_queue = ImageQueue()  # Images currently in the queue
+        self.queue_tk_img_obj = {}  # Tk images of the visible queue elements only
+        self.session = self.open_session()  # Queue, settings and thumbnails of the last run, None if unavailable
+        self.thumbnails = ThumbnailService(size=App.img_queue_size - 2, index=self.session)
+        self.session_save_job = None  # Pending after() id of a scheduled session save
+        self.batch_runner = None  # Active background batch conversion
+        self.ingest_iter = None  # Candidates of dropped paths that are still being discovered
 
         """INITS"""
 
+        add_listener(print_listener)  # Console output of conversion and drop events
+
         self.bind_all("<Button-1>", self.clear_focus, add="+")  # `add='+'` keeps existing bindings intact
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.poll_thumbnails()
+        self.after_idle(self.restore_session)
+
+    @staticmethod
+    def open_session():
+        try:
+            return SessionStore(App.session_path)
+        except (OSError, sqlite3.Error) as e:
+            print("Could not open the session file, the session will not be saved:", e)
+            return None
+
+    def restore_session(self):
+        """Bring back the queue, displayed image and its settings of the last run"""
+        if self.session is None:
+            return
+        try:
+            session = self.session.load()
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            print("Could not restore the last session:", e)
+            return
+
+        settings = None
+        if session.displayed is not None:
+            try:
+                self.load_main_display(session.displayed)
+                settings = session.settings.get(session.displayed)
+            except Exception as e:  # Still exists but can not be decoded anymore, the queue is restored anyway
+                print(f"Could not load {session.displayed}:", e)
+                self.clear_main_display()
+            if settings is not None:
+                self.path_entry_var.set(settings.out_dir)
+                self.file_name_entry_var.set(settings.file_name)
+                if settings.recipe is not None and settings.recipe.crop:
+                    self.toggle_crop_mode()
+                    self.dnd_area.set_recipe_crop(settings.recipe)
+
+        self.add_to_queue(session.queue)  # Visible thumbnails come from the session index
+
+    def schedule_session_save(self):
+        """Write the session shortly after the queue changed, so a crash loses neither the queue nor the thumbnail
+        index. Changes in quick succession, e.g. while a drop is ingested, are written together."""
+        if self.session is not None and self.session_save_job is None:
+            self.session_save_job = self.after(App.session_save_delay, self.save_session)
+
+    def save_session(self):
+        if self.session_save_job is not None:
+            self.after_cancel(self.session_save_job)
+            self.session_save_job = None
+        if self.session is None:
+            return
+
+        settings = {}
+        if self.displayed_img is not None:
+            recipe = self.dnd_area.get_recipe()
+            settings[self.displayed_img] = ImageSettings(self.path_entry_var.get(), self.file_name_entry_var.get(),
+                                                         None if recipe == Recipe() else recipe)
+        try:
+            self.session.save(Session(list(self.image_queue), self.displayed_img, settings))
+        except sqlite3.Error as e:
+            print("Could not save the session:", e)
+
+    def on_close(self):
+        self.save_session()
+        self.thumbnails.shutdown()
+        if self.session is not None:
+            self.session.close()
+        self.destroy()
 
     def clear_focus(self, event):
         """Clear focus if clicked widget is not an input"""
@@ -182,10 +273,19 @@ class App(TkinterDnD.Tk):
     def get_entry_path(self):
         return os.path.join(self.path_entry_var.get(), self.file_name_entry_var.get() + ".ico")
 
+    def convert_displayed(self, output_path) -> bool:
+        """Save the displayed image with its crop, False if it failed (e.g. over the decode budget)"""
+        try:
+            img = self.dnd_area.get_cropped_image()
+        except MemoryBudgetExceeded as e:  # Only JPEGs can be decoded at reduced scale
+            emit("convert.error", output=output_path, error=e)
+            return False
+        return convert_to_ico(pil_obj=img, output_path=output_path)
+
     def on_single_convert_btn(self):
 
         if self.displayed_img is not None:
-            convert_to_ico(pil_obj=self.dnd_area.get_cropped_image(), output_path=self.get_entry_path())
+            self.convert_displayed(self.get_entry_path())
 
         self.toggle_crop_mode(force_deactivate=True)
         self.load_from_queue()
@@ -193,10 +293,10 @@ class App(TkinterDnD.Tk):
     def on_convert_and_set_btn(self):
         out_path = self.get_entry_path()
 
-        if self.displayed_img is not None:
-            convert_to_ico(pil_obj=self.dnd_area.get_cropped_image(), output_path=out_path)
-
-        folder_path = filedialog.askdirectory(title="Select a folder")
+        if self.displayed_img is not None and not self.convert_displayed(out_path):
+            folder_path = None  # No icon to set
+        else:
+            folder_path = filedialog.askdirectory(title="Select a folder")
 
         if folder_path:
             set_folder_icon(folder_path, out_path)
@@ -205,7 +305,50 @@ class App(TkinterDnD.Tk):
         self.load_from_queue()
 
     def on_all_convert_button(self):
-        pass
+        if self.batch_runner is not None:  # Batch already running
+            return
+
+        out_dir = self.path_entry_var.get() or None
+
+        # Displayed image keeps its crop and is saved directly, the queue goes to the batch engine
+        if self.displayed_img is not None:
+            self.convert_displayed(self.get_entry_path())
+
+        # The crop of the displayed image is applied to the whole queue and saved next to each output for reruns
+        recipe = self.dnd_area.get_recipe()
+        recipe = None if recipe == Recipe() else recipe  # Nothing to apply
+        jobs = make_jobs(self.image_queue, out_dir=out_dir, recipe=recipe)
+        for job in jobs if recipe is not None else []:
+            try:
+                recipe.save(sidecar_path(job.output_path))
+            except OSError as e:
+                print(f"Could not save recipe for {job.output_path}:", e)
+        self.toggle_crop_mode(force_deactivate=True)
+        self.delete_queue()
+        self.clear_main_display()
+
+        if len(jobs) != 0:
+            self.batch_runner = BatchRunner(jobs).start()
+            self.all_convert_button.btn_config(text=f"Converting 0/{len(jobs)}...")
+            self.after(100, self.poll_batch)
+
+    def poll_batch(self):
+        runner = self.batch_runner
+
+        for result in runner.poll():
+            if result.success:
+                print(f"Created {result.job.output_path} in {result.duration:.2f}s")
+            else:
+                print(f"Error converting {result.job.src_path}:", result.error)
+
+        if runner.done:
+            failed = sum(1 for r in runner.results if not r.success)
+            print(f"Batch finished: {len(runner.results) - failed} converted, {failed} failed")
+            self.all_convert_button.btn_config(text="Apply transforms and save all as ICO")
+            self.batch_runner = None
+        else:
+            self.all_convert_button.btn_config(text=f"Converting {len(runner.results)}/{len(runner.jobs)}...")
+            self.after(100, self.poll_batch)
 
     def update_save_path_entries(self, path):
 
@@ -220,17 +363,15 @@ class App(TkinterDnD.Tk):
 
     @staticmethod
     def validate_file_drop(data):
-        matches = re.findall(r'\{([^}]+)\}|([^\s]+)', data)
-        paths = [m[0] or m[1] for m in matches]
-        valid_paths = [p for p in paths if p.split(".")[-1].lower() in App.valid_img_types]
-        print("Extracted valid paths:", valid_paths)
+        """Dropped files, directories and archives. Their images are discovered later by iter_candidates."""
+        valid_paths = [p for p in parse_drop_data(data) if is_ingestible(p)]
+        emit("drop.paths", paths=valid_paths)
         return valid_paths
 
     def on_drag_enter(self, event):
         print("Data is hovering over frame:", repr(event.data))
 
-        valid_paths = self.validate_file_drop(event.data)
-        if len(valid_paths) != 0:
+        if any(is_ingestible(p) for p in parse_drop_data(event.data)):
             self.dnd_border_frame.config(bg=App.cols["dnd_border_valid"])
         else:
             self.dnd_border_frame.config(bg=App.cols["dnd_border_invalid"])
@@ -243,30 +384,66 @@ class App(TkinterDnD.Tk):
         print("Data dropped:", repr(event.data))
         valid_paths = self.validate_file_drop(event.data)
 
-        if len(valid_paths) == 0:
-            pass
-        elif not self.displayed_img:
-            self.load_main_display(path=valid_paths[0])
-            self.add_to_queue(valid_paths[1:]) if len(valid_paths) > 1 else None
-        else:
-            self.add_to_queue(valid_paths)
+        if len(valid_paths) != 0:
+            candidates = iter_candidates(valid_paths)
+            if self.ingest_iter is None:
+                self.ingest_iter = candidates
+                self.after_idle(self.pump_ingest)
+            else:  # Still busy with an earlier drop
+                self.ingest_iter = chain(self.ingest_iter, candidates)
 
         self.dnd_border_frame.config(bg=App.cols["dnd_border_base"])
 
+    def pump_ingest(self):
+        """Move discovered images into the display and queue for a short time slice, then yield to the mainloop"""
+        deadline = time.perf_counter() + App.ingest_slice
+        found = []
+        finished = True  # Also true if the generator raised, so later drops start a fresh pump
+
+        try:
+            for candidate in self.ingest_iter:
+                if not self.displayed_img:
+                    try:
+                        self.load_main_display(path=candidate.path)
+                    except Exception as e:  # Valid signature but unreadable content, skip it
+                        print(f"Could not load {candidate.origin}:", e)
+                        self.clear_main_display()
+                else:
+                    found.append(candidate.path)
+                if time.perf_counter() >= deadline:
+                    finished = False
+                    break
+        except Exception as e:
+            print("Could not read dropped files:", e)
+        finally:
+            if finished:
+                self.ingest_iter = None
+
+        if found:
+            self.add_to_queue(found)
+        if self.ingest_iter is not None:
+            self.after(1, self.pump_ingest)
+
     def load_main_display(self, path):
-        img = load_img(path, set_size=App.img_preview_size)
-        tk_img = ImageTk.PhotoImage(img)
+        if self.displayed_doc is not None:
+            self.displayed_doc.close()
+        self.displayed_doc = ImageDocument(path, max_bytes=App.max_decode_bytes)
+
+        with stage("preview.load", source=path):
+            tk_img = ImageTk.PhotoImage(self.displayed_doc.preview(App.img_preview_size))
         center = int(App.img_preview_size / 2)
         self.dnd_area.create_image(center, center, anchor=tk.CENTER, image=tk_img)
         self.dnd_area.image = tk_img  # Keep reference
         self.dnd_area.displayed_img_path = path
+        self.dnd_area.document = self.displayed_doc
         self.update_save_path_entries(path)
         self.displayed_img = path
         self.update_dnd_img_infos()
+        self.schedule_session_save()
 
     def update_dnd_img_infos(self):
         try:
-            w, h = Image.open(self.displayed_img).size
+            w, h = self.displayed_doc.size
             self.dnd_img_info_dims.config(text=f"{w} x {h}")
 
             base_name = os.path.basename(self.displayed_img)
@@ -286,6 +463,7 @@ class App(TkinterDnD.Tk):
                 self.image_queue.append(path)
 
         self.update_queue_display()
+        self.schedule_session_save()
 
     def load_from_queue(self):
         if len(self.image_queue) != 0:
@@ -297,47 +475,46 @@ class App(TkinterDnD.Tk):
 
     def clear_main_display(self):
         self.dnd_area.image = None
+        self.dnd_area.displayed_img_path = None
+        self.dnd_area.document = None
+        if self.displayed_doc is not None:
+            self.displayed_doc.close()  # Release the decoded source
+            self.displayed_doc = None
         self.update_save_path_entries("")
         self.displayed_img = None
         self.update_dnd_img_infos()
+        self.schedule_session_save()
 
     def delete_queue(self):
         self.image_queue.clear()
         self.update_queue_display()
+        self.schedule_session_save()
 
-    def update_queue_display(self):
-        elem_per_row = 4
-        max_rows = 6
-
-        for elem in self.queue_frame.winfo_children():
-            elem.destroy()
-
-        for i, item in enumerate(self.image_queue):
+    def poll_thumbnails(self):
+        self.thumbnails.poll()
+        self.after(50, self.poll_thumbnails)
 
-            # New queue element:
-            elem_frame = tk.Frame(self.queue_frame, width=App.img_queue_size, height=App.img_queue_size,
-                                  bg=self.queue_frame.cget("bg"))
-            elem_frame.grid(row=i // elem_per_row, column=elem_per_row - i % elem_per_row)
-            elem_frame.pack_propagate(False)
+    def on_thumbnail_loaded(self, path, img):
+        if img is None or path not in self.queue_frame.visible_paths:  # Failed or no longer visible
+            return
 
-            if i >= elem_per_row * max_rows - 1 and len(self.image_queue) > elem_per_row * max_rows:
-                info_label = tk.Label(elem_frame, text=f"+{len(self.image_queue) - elem_per_row * max_rows + 1}",
-                                      bg=App.cols["dnd_border_base"], font=Font(size=10, weight="bold"))
-                info_label.pack(padx=1, pady=1, anchor="center", fill="both", expand=True)
-                break
+        self.queue_tk_img_obj[path] = ImageTk.PhotoImage(img)
+        self.queue_frame.set_image(path, self.queue_tk_img_obj[path])
 
-            if item not in self.queue_tk_img_obj.keys():
-                tk_img = ImageTk.PhotoImage(load_img(item, set_size=App.img_queue_size - 2))
-                self.queue_tk_img_obj[item] = tk_img
+    def update_queue_display(self):
+        capacity = self.queue_frame.capacity
+        overflow = len(self.image_queue) - capacity + 1 if len(self.image_queue) > capacity else 0
+        visible = self.image_queue.head(capacity - 1 if overflow else capacity)
 
-            img_label = tk.Label(elem_frame, image=self.queue_tk_img_obj[item], bg=App.cols["dnd_border_base"])
-            img_label.pack(padx=1, pady=1, anchor="center", fill="both", expand=True)
+        # Drop Tk images of elements that are no longer visible, the PIL thumbnails stay in the bounded cache
+        for path in [p for p in self.queue_tk_img_obj if p not in visible]:
+            del self.queue_tk_img_obj[path]
 
-        if len(self.image_queue) != 0:
+        self.queue_frame.show(visible, overflow=overflow, images=self.queue_tk_img_obj)
 
-            delete_button = BorderBtn(self.queue_frame, text="Clear Queue", command=self.delete_queue,
-                                      palette=BtnPalette.red_light(), border_width=1)
-            delete_button.grid(row=max_rows+1, column=1, columnspan=elem_per_row, sticky="ew", padx=1, pady=1)
+        for path in visible:
+            if path not in self.queue_tk_img_obj:
+                self.thumbnails.request(path, self.on_thumbnail_loaded)
 
 
 if __name__ == '__main__':
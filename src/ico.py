@@ -0,0 +1,143 @@
+"""Inspection and in-place editing of ICO files without decoding their images.
+
+    for entry in read_directory("icon.ico"):
+        print(entry.width, entry.bit_count, entry.encoding, entry.size)
+
+    icon = IcoFile.load("icon.ico")
+    icon.replace(Image.open("hand_tuned_16.png"))  # Other entries keep their encoded bytes
+    icon.remove(64)
+    icon.save("icon.ico")
+"""
+import io
+from dataclasses import dataclass
+from typing import List, Optional, Union
+from PIL import Image
+from ico_writer import ICONDIR, ICONDIRENTRY, IcoEntry, EncodeOptions, encode_entry, pack_ico
+
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+
+@dataclass
+class IcoDirEntry:
+    """One row of the ICO directory table"""
+    width: int
+    height: int
+    color_count: int
+    planes: int
+    bit_count: int
+    size: int  # Bytes of the image data
+    offset: int
+    encoding: str  # "png" or "bmp", sniffed from the first bytes of the image data
+
+
+def _read_all(source) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "read"):
+        return source.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _parse_directory(read_at) -> List[IcoDirEntry]:
+    """Parse the table with read_at(offset, length), which only needs to touch header bytes"""
+    reserved, kind, count = ICONDIR.unpack(read_at(0, ICONDIR.size))
+    if reserved != 0 or kind != 1:
+        raise ValueError("Not an ICO file")
+
+    table = read_at(ICONDIR.size, ICONDIRENTRY.size * count)
+    entries = []
+    for i in range(count):
+        width, height, colors, _, planes, bits, size, offset = ICONDIRENTRY.unpack_from(table, i * ICONDIRENTRY.size)
+        encoding = "png" if read_at(offset, len(PNG_MAGIC)) == PNG_MAGIC else "bmp"
+        entries.append(IcoDirEntry(width or 256, height or 256, colors, planes, bits, size, offset, encoding))
+    return entries
+
+
+def read_directory(source) -> List[IcoDirEntry]:
+    """Directory of an ICO given as path, bytes or binary file object. Only header bytes are read from files."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        return _parse_directory(lambda offset, length: data[offset:offset + length])
+
+    def read_file_at(f):
+        def read_at(offset, length):
+            f.seek(offset)
+            return f.read(length)
+        return read_at
+
+    if hasattr(source, "read"):
+        return _parse_directory(read_file_at(source))
+    with open(source, "rb") as f:
+        return _parse_directory(read_file_at(f))
+
+
+class IcoFile:
+    """Encoded entries of an ICO file. Editing one size never re-encodes the others."""
+
+    def __init__(self, entries: Optional[List[IcoEntry]] = None):
+        self.entries: List[IcoEntry] = entries or []
+
+    @classmethod
+    def load(cls, source) -> "IcoFile":
+        data = _read_all(source)
+        entries = []
+        for d in read_directory(data):
+            entries.append(IcoEntry(d.width, d.height, d.bit_count, data[d.offset:d.offset + d.size], d.encoding,
+                                    color_count=d.color_count))
+        return cls(entries)
+
+    def sizes(self) -> List[int]:
+        return sorted({e.width for e in self.entries})
+
+    def get(self, size: int) -> Optional[IcoEntry]:
+        for entry in self.entries:
+            if entry.width == size:
+                return entry
+        return None
+
+    def image(self, size: int) -> Image.Image:
+        """Decode a single entry"""
+        entry = self.get(size)
+        if entry is None:
+            raise KeyError(f"No {size}px entry")
+        with Image.open(io.BytesIO(self.to_bytes([entry]))) as img:
+            img.load()
+            return img.copy()
+
+    @staticmethod
+    def _as_entry(frame: Union[Image.Image, IcoEntry], options: Optional[EncodeOptions]) -> IcoEntry:
+        if isinstance(frame, IcoEntry):
+            return frame
+        if frame.width != frame.height or not 1 <= frame.width <= 256:
+            raise ValueError(f"ICO entries must be square and at most 256px, got {frame.size}")
+        return encode_entry(frame, options or EncodeOptions())
+
+    def add(self, frame: Union[Image.Image, IcoEntry], options: Optional[EncodeOptions] = None):
+        """Add an entry, raises if the size already exists (use replace)"""
+        entry = self._as_entry(frame, options)
+        if self.get(entry.width) is not None:
+            raise ValueError(f"A {entry.width}px entry already exists")
+        self.entries.append(entry)
+
+    def replace(self, frame: Union[Image.Image, IcoEntry], options: Optional[EncodeOptions] = None):
+        """Add or replace the entry with the frame's size"""
+        entry = self._as_entry(frame, options)
+        self.entries = [e for e in self.entries if e.width != entry.width] + [entry]
+
+    def remove(self, size: int):
+        before = len(self.entries)
+        self.entries = [e for e in self.entries if e.width != size]
+        if len(self.entries) == before:
+            raise KeyError(f"No {size}px entry")
+
+    def to_bytes(self, entries: Optional[List[IcoEntry]] = None) -> bytes:
+        return pack_ico(self.entries if entries is None else entries)
+
+    def save(self, output):
+        data = self.to_bytes()
+        if hasattr(output, "write"):
+            output.write(data)
+        else:
+            with open(output, "wb") as f:
+                f.write(data)
@@ -0,0 +1,123 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+CACHE_VERSION = 3  # Bump when the conversion output changes so old entries are not served anymore
+
+
+def file_digest(path, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class IcoCache:
+    """On-disk cache of finished ICO files, keyed by source content and conversion settings.
+
+    Entries are plain .ico files, the file mtime doubles as last-used time for eviction. Writes are atomic, so
+    several worker processes can share one cache directory.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 512 * 1024 * 1024, max_age: float = 30 * 24 * 3600,
+                 hardlink: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # Seconds since last use
+        self.hardlink = hardlink  # Hardlinked outputs must not be edited in place, they share data with the cache
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(src_path, hash_content: bool = True, **settings) -> str:
+        """Cache key of a conversion, settings are all options that change the output (sizes, crop_box, ...).
+
+        With hash_content the source bytes are hashed, which survives fresh checkouts. Otherwise path, size and
+        mtime are used, which avoids reading the file at all.
+        """
+        if hash_content:
+            source = file_digest(src_path)
+        else:
+            stat = os.stat(src_path)
+            source = f"{os.path.abspath(src_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        key = repr((CACHE_VERSION, source, sorted(settings.items())))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def entry_path(self, key) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".ico")
+
+    def fetch(self, key, output_path) -> bool:
+        """Place the cached ICO at output_path. Returns False on a cache miss."""
+        entry = self.entry_path(key)
+        if not os.path.exists(entry):
+            return False
+
+        try:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            if self.hardlink:
+                try:
+                    os.link(entry, output_path)
+                except OSError:  # Different file system or not supported
+                    shutil.copyfile(entry, output_path)
+            else:
+                shutil.copyfile(entry, output_path)
+            os.utime(entry)  # Mark as recently used
+        except FileNotFoundError:  # Evicted in the meantime
+            return False
+
+        return True
+
+    def store(self, key, ico_path):
+        """Copy a finished ICO into the cache. Eviction is left to evict() so workers do not race on it."""
+        entry = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, open(ico_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+            os.replace(tmp_path, entry)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def entries(self):
+        """All cache entries as (path, size, mtime)"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".ico"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((path, stat.st_size, stat.st_mtime))
+        return found
+
+    def evict(self) -> int:
+        """Remove entries unused for longer than max_age, then the least recently used until under max_bytes.
+
+        Returns the number of removed entries.
+        """
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda e: e[2])  # Oldest first
+        total = sum(e[1] for e in entries)
+        removed = 0
+
+        for path, size, mtime in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return removed
@@ -0,0 +1,120 @@
+"""ICO container writer with a per-size choice between PNG and BMP (DIB) entries.
+
+Frames are encoded independently, optionally in threads (Pillow releases the GIL while compressing), and the
+ICONDIR/ICONDIRENTRY table is written directly, so the output never needs to seek.
+
+ICO layout: ICONDIR (6 bytes), one ICONDIRENTRY (16 bytes) per image, then the image data blocks.
+"""
+import io
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, List, Dict
+from PIL import Image
+
+ICONDIR = struct.Struct("<HHH")  # Reserved, type (1 = icon), image count
+ICONDIRENTRY = struct.Struct("<BBBBHHII")  # Width, height, colors, reserved, planes, bit count, bytes, offset
+BITMAPINFOHEADER = struct.Struct("<IiiHHIIiiII")
+
+
+@dataclass
+class EncodeOptions:
+    bmp_max_size: int = 48  # Sizes up to this are stored as uncompressed BMP, which loads fastest
+    compress_level: int = 6  # zlib level of PNG entries, 0 (fastest) to 9 (smallest)
+    encodings: Optional[Dict[int, str]] = None  # Per size override, "png" or "bmp"
+    max_workers: Optional[int] = 1  # Threads for encoding entries, None picks a default, 1 disables threading
+    optimize: bool = False  # Try smaller lossless encodings, see optimize.optimize_entry
+    palette_max_size: int = 48  # Largest BMP size that may become a 4 or 8 bit palette entry when optimizing
+
+    def encoding_for(self, size: int) -> str:
+        if self.encodings and size in self.encodings:
+            return self.encodings[size]
+        return "bmp" if size <= self.bmp_max_size else "png"
+
+
+@dataclass
+class IcoEntry:
+    """One encoded image of an ICO file"""
+    width: int
+    height: int
+    bit_count: int
+    data: bytes
+    encoding: str  # "png" or "bmp"
+    color_count: int = 0  # Palette size for entries below 8 bits, else 0
+    original_size: Optional[int] = None  # Bytes of the plain encoding, set for optimized entries
+
+
+def and_mask_bytes(alpha: Image.Image) -> bytes:
+    """1 bit AND mask, bottom-up with rows padded to 32 bits. Fully transparent pixels are set."""
+    width, height = alpha.size
+    mask = alpha.point(lambda a: 255 if a == 0 else 0).convert("1")
+    row_bytes = (width + 7) // 8
+    padded = (row_bytes + 3) // 4 * 4
+    packed = mask.tobytes("raw", "1")
+    rows = [packed[y * row_bytes:(y + 1) * row_bytes].ljust(padded, b"\0") for y in range(height)]
+    return b"".join(reversed(rows))
+
+
+def encode_bmp(frame: Image.Image) -> IcoEntry:
+    """32 bit BGRA DIB entry. The header height covers the colour data plus the AND mask, as ICO expects."""
+    frame = frame.convert("RGBA") if frame.mode != "RGBA" else frame
+    width, height = frame.size
+    pixels = frame.tobytes("raw", "BGRA", 0, -1)  # Bottom-up rows
+    mask = and_mask_bytes(frame.getchannel("A"))
+    header = BITMAPINFOHEADER.pack(BITMAPINFOHEADER.size, width, height * 2, 1, 32, 0, len(pixels) + len(mask),
+                                   0, 0, 0, 0)
+    return IcoEntry(width, height, 32, header + pixels + mask, "bmp")
+
+
+def encode_png(frame: Image.Image, compress_level: int = 6) -> IcoEntry:
+    frame = frame.convert("RGBA") if frame.mode != "RGBA" else frame
+    buffer = io.BytesIO()
+    frame.save(buffer, "PNG", compress_level=compress_level)
+    return IcoEntry(frame.width, frame.height, 32, buffer.getvalue(), "png")
+
+
+def encode_entry(frame: Image.Image, options: EncodeOptions) -> IcoEntry:
+    if options.optimize:
+        from optimize import optimize_entry  # optimize builds on the encoders of this module
+        return optimize_entry(frame, options)
+    if options.encoding_for(frame.width) == "bmp":
+        return encode_bmp(frame)
+    return encode_png(frame, options.compress_level)
+
+
+def encode_entries(frames: List[Image.Image], options: Optional[EncodeOptions] = None) -> List[IcoEntry]:
+    options = options or EncodeOptions()
+    if options.max_workers == 1 or len(frames) <= 1:
+        return [encode_entry(frame, options) for frame in frames]
+
+    with ThreadPoolExecutor(max_workers=options.max_workers) as executor:
+        return list(executor.map(lambda frame: encode_entry(frame, options), frames))
+
+
+def pack_ico(entries: List[IcoEntry]) -> bytes:
+    """Assemble encoded entries into an ICO file, sorted from small to large like Pillow and Windows do"""
+    entries = sorted(entries, key=lambda e: (e.width, e.bit_count))
+    parts = [ICONDIR.pack(0, 1, len(entries))]
+
+    offset = ICONDIR.size + ICONDIRENTRY.size * len(entries)
+    for entry in entries:
+        parts.append(ICONDIRENTRY.pack(entry.width % 256, entry.height % 256,  # 0 means 256
+                                       entry.color_count, 0, 1, entry.bit_count, len(entry.data), offset))
+        offset += len(entry.data)
+
+    parts.extend(entry.data for entry in entries)
+    return b"".join(parts)
+
+
+def write_ico(frames: List[Image.Image], output, options: Optional[EncodeOptions] = None) -> List[IcoEntry]:
+    """Encode frames and write the ICO to a path or a writable binary file object. Returns the written entries."""
+    entries = encode_entries(frames, options)
+    data = pack_ico(entries)
+
+    if hasattr(output, "write"):
+        output.write(data)
+    else:
+        with open(output, "wb") as f:
+            f.write(data)
+
+    return entries
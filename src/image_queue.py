@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterable, List
+
+
+class ImageQueue:
+    """Ordered set of image paths with O(1) append, membership test, popleft and remove."""
+
+    def __init__(self, paths: Iterable[str] = ()):
+        self._items = OrderedDict()  # Linked list backed, so popping from the front stays O(1)
+        for path in paths:
+            self.append(path)
+
+    def append(self, path) -> bool:
+        """Add path to the end of the queue. Returns False if it was already queued."""
+        if path in self._items:
+            return False
+        self._items[path] = None
+        return True
+
+    def popleft(self):
+        if not self._items:
+            raise IndexError("pop from an empty queue")
+        return self._items.popitem(last=False)[0]
+
+    def remove(self, path):
+        del self._items[path]
+
+    def clear(self):
+        self._items.clear()
+
+    def head(self, n: int) -> List[str]:
+        """First n paths without copying the whole queue"""
+        return list(islice(self._items, n))
+
+    def __contains__(self, path):
+        return path in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __repr__(self):
+        return f"ImageQueue({list(self._items)!r})"
@@ -0,0 +1,264 @@
+"""Lazy discovery of source images in files, directories, glob patterns and zip/tar archives.
+
+    for candidate in iter_candidates(["photo.jpg", "assets/", "icons.zip"], exclude=["*/thumbs/*"]):
+        print(candidate.path, candidate.format)
+
+Candidates are yielded while the inputs are walked, so consumers can start on the first image before a large tree
+is enumerated. The format is sniffed from the first bytes of each file, the extension is ignored. Archive members
+are extracted one at a time to a temporary folder when they are reached.
+"""
+import os
+import re
+import glob
+import time
+import zlib
+import atexit
+import shutil
+import fnmatch
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+SNIFF_BYTES = 512  # Enough for the "ustar" marker of tar headers at offset 257
+
+IMAGE_SIGNATURES = [  # (offset, magic bytes, format)
+    (0, b"\x89PNG\r\n\x1a\n", "png"),
+    (0, b"\xff\xd8\xff", "jpeg"),
+    (0, b"GIF87a", "gif"),
+    (0, b"GIF89a", "gif"),
+    (8, b"WEBP", "webp"),  # After "RIFF" and the chunk size
+]
+COMPRESSED_TAR_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+# Raised while reading archives: RuntimeError for encrypted zip members, NotImplementedError for unsupported
+# compression, zlib.error and EOFError for truncated streams
+ARCHIVE_ERRORS = (OSError, EOFError, RuntimeError, NotImplementedError, zlib.error, zipfile.BadZipFile,
+                  tarfile.TarError)
+
+
+@dataclass
+class Candidate:
+    path: str  # Readable file, for archive members the extracted copy
+    format: str  # Sniffed image format, see IMAGE_SIGNATURES
+    archive: Optional[str] = None  # Archive the file was extracted from
+    member: Optional[str] = None  # Name inside the archive
+    rel_path: str = ""  # Path below the input directory it was found in, see archive_stem for archive members
+
+    @property
+    def origin(self) -> str:
+        return f"{self.archive}!{self.member}" if self.archive else self.path
+
+    def output_path(self, out_dir: Optional[str] = None) -> str:
+        """Where the ICO goes: rel_path below out_dir, so sources in different folders never share an output.
+
+        Without out_dir files are converted next to themselves and archive members next to the archive, in a
+        folder named after it.
+        """
+        if out_dir is not None:
+            target = os.path.join(out_dir, os.path.normpath(self.rel_path or os.path.basename(self.path)))
+        elif self.archive is not None:
+            target = os.path.join(os.path.dirname(self.archive), archive_stem(self.archive),
+                                  os.path.normpath(self.member))
+        else:
+            target = self.path
+        return os.path.splitext(target)[0] + ".ico"
+
+
+def archive_stem(path) -> str:
+    """Archive file name without its extensions, icons.tar.gz -> icons. Archive members are output below it."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem[:-4] if stem.lower().endswith(".tar") else stem
+
+
+def sniff_image(header: bytes) -> Optional[str]:
+    """Image format of the file starting with header, None if it is not a supported image"""
+    for offset, magic, fmt in IMAGE_SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            if fmt == "webp" and header[:4] != b"RIFF":
+                continue
+            return fmt
+    return None
+
+
+def sniff_archive(header: bytes) -> Optional[str]:
+    if header[:4] == b"PK\x03\x04":
+        return "zip"
+    if header[257:262] == b"ustar" or header.startswith(COMPRESSED_TAR_MAGIC):
+        return "tar"  # Compressed streams may hold something else, opening them tells
+    return None
+
+
+def read_header(path) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read(SNIFF_BYTES)
+    except OSError:
+        return b""
+
+
+def parse_drop_data(data: str) -> List[str]:
+    """Split a Tk drop string. Paths containing spaces are wrapped in braces."""
+    matches = re.findall(r'\{([^}]+)\}|([^\s]+)', data)
+    return [m[0] or m[1] for m in matches]
+
+
+def is_ingestible(path) -> bool:
+    """Quick check for drag feedback: a directory, an image or an archive"""
+    if os.path.isdir(path):
+        return True
+    header = read_header(path)
+    return sniff_image(header) is not None or sniff_archive(header) is not None
+
+
+def _matches(rel_path, include: Optional[List[str]], exclude: Optional[List[str]]) -> bool:
+    rel_path = rel_path.replace(os.sep, "/")
+    name = rel_path.rsplit("/", 1)[-1]
+    if include and not any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in include):
+        return False
+    return not (exclude and any(fnmatch.fnmatch(rel_path, p) or fnmatch.fnmatch(name, p) for p in exclude))
+
+
+_session_dir = None
+
+
+def _default_extract_dir() -> str:
+    """Temp folder for extracted archive members, removed when the process exits"""
+    global _session_dir
+    if _session_dir is None:
+        _session_dir = tempfile.mkdtemp(prefix="ico_ingest_")
+        atexit.register(shutil.rmtree, _session_dir, ignore_errors=True)
+    return _session_dir
+
+
+def _walk(root, recursive: bool) -> Iterator[str]:
+    """Files below root in sorted order, one directory listing at a time"""
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_file():
+            yield entry.path
+        elif recursive and entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path, recursive)
+
+
+def _safe_member_path(extract_dir, archive, member) -> Optional[str]:
+    """Extraction target of member, None if the name would escape the extract folder"""
+    base = os.path.join(extract_dir, hashlib.sha1(os.fsencode(archive)).hexdigest()[:12])
+    target = os.path.normpath(os.path.join(base, member))
+    return target if target.startswith(base + os.sep) else None
+
+
+def _extract(stream, target, mtime: float, header: bytes = b""):
+    """Write header and the rest of stream to target. The archived mtime is kept for up-to-date checks."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, "wb") as f:
+        f.write(header)
+        shutil.copyfileobj(stream, f)
+    os.utime(target, (mtime, mtime))
+
+
+def _discard(target):
+    """Remove a partly extracted member"""
+    try:
+        os.remove(target)
+    except OSError:
+        pass
+
+
+def _iter_zip(path, extract_dir, include, exclude) -> Iterator[Candidate]:
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not _matches(info.filename, include, exclude):
+                continue
+            target = _safe_member_path(extract_dir, path, info.filename)
+            if target is None:
+                continue
+            try:
+                with archive.open(info) as stream:
+                    fmt = sniff_image(stream.read(SNIFF_BYTES))
+                if fmt is None:
+                    continue
+                with archive.open(info) as stream:
+                    _extract(stream, target, time.mktime(info.date_time + (0, 0, -1)))
+            except ARCHIVE_ERRORS:  # Encrypted, unsupported compression or damaged, skip just this member
+                _discard(target)
+                continue
+            yield Candidate(target, fmt, archive=path, member=info.filename, rel_path=info.filename)
+
+
+def _iter_tar(path, extract_dir, include, exclude) -> Iterator[Candidate]:
+    try:
+        archive = tarfile.open(path, "r:*")
+    except tarfile.TarError:  # Compressed file that is not a tar
+        return
+    with archive:
+        for info in archive:  # Streams through the archive, members are read in order
+            if not info.isfile() or not _matches(info.name, include, exclude):
+                continue
+            target = _safe_member_path(extract_dir, path, info.name)
+            if target is None:
+                continue
+            try:
+                stream = archive.extractfile(info)
+                header = stream.read(SNIFF_BYTES)
+                fmt = sniff_image(header)
+                if fmt is None:
+                    continue
+                _extract(stream, target, info.mtime, header=header)
+            except ARCHIVE_ERRORS:  # Skip the member, a broken stream also ends the loop above
+                _discard(target)
+                continue
+            yield Candidate(target, fmt, archive=path, member=info.name, rel_path=info.name)
+
+
+def iter_candidates(inputs: Iterable[str], recursive: bool = True, include: Optional[List[str]] = None,
+                    exclude: Optional[List[str]] = None, archives: bool = True,
+                    extract_dir: Optional[str] = None) -> Iterator[Candidate]:
+    """Yield the images found in inputs, each file at most once.
+
+    inputs are files, directories, archives or glob patterns. include and exclude are glob patterns matched
+    against the file name and the path relative to the input directory (or inside the archive). Archive members
+    are extracted to extract_dir, a temp folder that is removed at exit by default.
+    """
+    seen = set()
+
+    def from_file(path, rel_path) -> Iterator[Candidate]:
+        real = os.path.realpath(path)
+        if real in seen:
+            return
+        seen.add(real)
+
+        header = read_header(path)
+        fmt = sniff_image(header)
+        if fmt is not None:
+            if _matches(rel_path, include, exclude):
+                yield Candidate(os.path.abspath(path), fmt, rel_path=rel_path)
+            return
+
+        kind = sniff_archive(header) if archives else None
+        if kind is not None:
+            target_dir = extract_dir or _default_extract_dir()
+            iter_members = _iter_zip if kind == "zip" else _iter_tar
+            try:
+                for candidate in iter_members(os.path.abspath(path), target_dir, include, exclude):
+                    # Members go below a folder named after the archive, so archives next to each other never collide
+                    candidate.rel_path = os.path.join(os.path.dirname(rel_path), archive_stem(path), candidate.member)
+                    yield candidate
+            except ARCHIVE_ERRORS:
+                pass  # Damaged archive, keep going with the other inputs
+
+    for item in inputs:
+        if os.path.isdir(item):
+            for path in _walk(item, recursive):
+                yield from from_file(path, os.path.relpath(path, item))
+        elif os.path.isfile(item):
+            yield from from_file(item, os.path.basename(item))
+        else:
+            for path in sorted(glob.iglob(item, recursive=True)):
+                if os.path.isfile(path):
+                    yield from from_file(path, os.path.basename(path))
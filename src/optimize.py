@@ -0,0 +1,104 @@
+"""Lossless size optimization of ICO entries.
+
+Small frames with binary alpha and few colors become 4 or 8 bit palettized BMP entries with a 1 bit AND mask.
+PNG entries are re-encoded as RGBA at maximum compression and the smallest encoding wins. Every candidate decodes
+to exactly the same pixels.
+"""
+import io
+import sys
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from ico_writer import BITMAPINFOHEADER, IcoEntry, EncodeOptions, and_mask_bytes, encode_bmp, encode_png
+
+TRANSPARENT = (0, 0, 0, 0)
+
+
+def binary_alpha(frame: Image.Image) -> bool:
+    """True if every pixel is either fully transparent or fully opaque"""
+    colors = frame.getchannel("A").getcolors(256)
+    return all(alpha in (0, 255) for _, alpha in colors)
+
+
+def normalized_colors(frame: Image.Image, max_colors: int = 256) -> Optional[List[Tuple[int, int, int, int]]]:
+    """Distinct colors with all transparent pixels folded into one, None if there are more than max_colors"""
+    colors = frame.getcolors(max_colors + 1)
+    if colors is None:
+        return None
+    unique = {TRANSPARENT if c[3] == 0 else c for _, c in colors}
+    if len(unique) > max_colors:
+        return None
+    # Transparent first, so it gets index 0 which is black in the palette, as the AND mask expects
+    return sorted(unique, key=lambda c: c != TRANSPARENT)
+
+
+def indexed_pixels(frame: Image.Image, index: Dict[Tuple[int, int, int, int], int]) -> Image.Image:
+    """P image holding index[color] for every pixel of an RGBA frame. index must cover all colors of the frame.
+
+    Pixels are looked up as 32 bit integers straight from the raw bytes, which avoids a tuple per pixel.
+    """
+    lookup = {int.from_bytes(bytes(c), sys.byteorder): i for c, i in index.items()}
+    pixels = memoryview(frame.tobytes()).cast("I")
+    return Image.frombytes("P", frame.size, bytes(map(lookup.__getitem__, pixels)))
+
+
+def encode_bmp_palette(frame: Image.Image) -> Optional[IcoEntry]:
+    """4 or 8 bit palettized BMP entry, None if that would lose information"""
+    frame = frame.convert("RGBA") if frame.mode != "RGBA" else frame
+    if not binary_alpha(frame):
+        return None
+    colors = normalized_colors(frame)
+    if colors is None:
+        return None
+
+    bits = 4 if len(colors) <= 16 else 8
+    index = {c: i for i, c in enumerate(colors)}
+    width, height = frame.size
+
+    palette = b"".join(bytes((c[2], c[1], c[0], 0)) for c in colors)  # RGBQUAD is BGR0
+    palette = palette.ljust(4 * (1 << bits), b"\0")
+
+    raw_index = {c: index[TRANSPARENT if c[3] == 0 else c] for _, c in frame.getcolors(width * height)}
+    row_bytes = (width * bits + 31) // 32 * 4
+    # The raw encoder packs the nibbles, pads the rows to 32 bits and writes them bottom-up, as BMP expects
+    xor_data = indexed_pixels(frame, raw_index).tobytes("raw", ("P;4" if bits == 4 else "P", row_bytes, -1))
+
+    mask = and_mask_bytes(frame.getchannel("A"))
+    header = BITMAPINFOHEADER.pack(BITMAPINFOHEADER.size, width, height * 2, 1, bits, 0,
+                                   len(xor_data) + len(mask), 0, 0, 1 << bits, 0)
+    color_count = 16 if bits == 4 else 0  # The directory stores 0 for 256 colors
+    return IcoEntry(width, height, bits, header + palette + xor_data + mask, "bmp", color_count=color_count)
+
+
+def png_candidates(frame: Image.Image) -> List[bytes]:
+    """Lossless PNG encodings of the frame at maximum compression.
+
+    All of them stay 32 bit RGBA: ICO readers, Pillow included, drop the tRNS chunk of palette PNG entries and
+    the directory announces 32 bit for every PNG entry, so palette and grayscale variants would decode wrong.
+    """
+    frame = frame.convert("RGBA") if frame.mode != "RGBA" else frame
+    encoded = []
+    for params in ({"optimize": True}, {"compress_level": 9}):
+        buffer = io.BytesIO()
+        frame.save(buffer, "PNG", **params)
+        encoded.append(buffer.getvalue())
+    return encoded
+
+
+def optimize_entry(frame: Image.Image, options: EncodeOptions) -> IcoEntry:
+    """Smallest lossless entry for the frame. original_size keeps the size of the plain encoding."""
+    if options.encoding_for(frame.width) == "bmp":
+        baseline = encode_bmp(frame)
+        best = baseline
+        if frame.width <= options.palette_max_size:
+            palettized = encode_bmp_palette(frame)
+            if palettized is not None and len(palettized.data) < len(best.data):
+                best = palettized
+    else:
+        baseline = encode_png(frame, options.compress_level)
+        best = baseline
+        for data in png_candidates(frame):
+            if len(data) < len(best.data):
+                best = IcoEntry(frame.width, frame.height, 32, data, "png")
+
+    best.original_size = len(baseline.data)
+    return best
@@ -0,0 +1,149 @@
+"""Structured timing events for the conversion pipeline.
+
+Hot paths wrap their work in `stage(...)` blocks or call `emit(...)`. Nothing is recorded unless a listener is
+registered, so the hooks cost next to nothing in normal runs.
+
+    with capture(cprofile=True, memory=True) as cap:
+        convert_to_ico(img, "out.ico")
+    print(cap.recorder.totals(), cap.memory_peak)
+    cap.print_stats()
+"""
+import io
+import time
+import pstats
+import cProfile
+import tracemalloc
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Optional, List, Dict
+
+_listeners: List[Callable[["Event"], None]] = []
+_listeners_lock = threading.Lock()
+
+
+@dataclass
+class Event:
+    name: str  # Dotted stage name, e.g. "convert.resample"
+    duration: Optional[float] = None  # Seconds, None for point events
+    fields: Dict = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+
+def add_listener(listener: Callable[[Event], None]):
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[Event], None]):
+    with _listeners_lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def enabled() -> bool:
+    return bool(_listeners)
+
+
+def emit(name, duration: Optional[float] = None, **fields):
+    if not _listeners:
+        return
+    event = Event(name, duration, fields)
+    for listener in list(_listeners):
+        listener(event)
+
+
+@contextmanager
+def stage(name, **fields):
+    """Time the block and emit it as an event. The yielded dict can be used to add fields inside the block."""
+    if not _listeners:
+        yield fields
+        return
+
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        emit(name, time.perf_counter() - start, **fields)
+
+
+def print_listener(event: Event):
+    """Console output in the style of the former print calls"""
+    details = ", ".join(f"{k}={v}" for k, v in event.fields.items())
+    if event.duration is not None:
+        print(f"[{event.name}] {event.duration * 1000:.2f}ms {details}")
+    else:
+        print(f"[{event.name}] {details}")
+
+
+class EventRecorder:
+    """Listener that keeps all events, e.g. to find the slowest files of a batch"""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix  # Only record events starting with this
+        self.events: List[Event] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        if event.name.startswith(self.prefix):
+            with self._lock:
+                self.events.append(event)
+
+    def totals(self) -> Dict[str, float]:
+        """Summed duration per stage name"""
+        totals = {}
+        for event in self.events:
+            if event.duration is not None:
+                totals[event.name] = totals.get(event.name, 0.0) + event.duration
+        return totals
+
+    def slowest(self, name, n: int = 10) -> List[Event]:
+        timed = [e for e in self.events if e.name == name and e.duration is not None]
+        return sorted(timed, key=lambda e: e.duration, reverse=True)[:n]
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+
+@dataclass
+class Capture:
+    recorder: EventRecorder
+    profile: Optional[cProfile.Profile] = None
+    memory_peak: Optional[int] = None  # Bytes allocated by Python at the peak, needs memory=True
+    memory_top: Optional[List] = None  # Largest allocation sites as tracemalloc statistics
+
+    def print_stats(self, sort="cumulative", limit=25):
+        if self.profile is None:
+            return
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(limit)
+        print(stream.getvalue())
+
+
+@contextmanager
+def capture(cprofile: bool = False, memory: bool = False, prefix: str = ""):
+    """Record all events of the block, optionally with cProfile and tracemalloc running."""
+    cap = Capture(EventRecorder(prefix))
+    add_listener(cap.recorder)
+
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    if memory:
+        tracemalloc.reset_peak()
+    if cprofile:
+        cap.profile = cProfile.Profile()
+        cap.profile.enable()
+
+    try:
+        yield cap
+    finally:
+        if cprofile:
+            cap.profile.disable()
+        if memory:
+            cap.memory_peak = tracemalloc.get_traced_memory()[1]
+            cap.memory_top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+            if started_tracemalloc:
+                tracemalloc.stop()
+        remove_listener(cap.recorder)
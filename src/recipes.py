@@ -0,0 +1,125 @@
+"""Serializable transform recipes that can be applied to any number of images.
+
+A recipe stores the crop as fractions of the image size, so the crop chosen on one preview can be reused on other
+images and at any decode scale. Recipes are saved as JSON sidecars next to the ICO they produced
+(icon.ico -> icon.recipe.json), so a rerun from the command line gives the same result without the GUI.
+
+    recipe = Recipe(crop=(0.1, 0.1, 0.9, 0.9), square="pad", background=(255, 255, 255, 255), sharpen=True)
+    recipe.save(sidecar_path("out/icon.ico"))
+"""
+import os
+import json
+from dataclasses import dataclass, asdict
+from typing import Optional, Tuple
+from PIL import Image
+from autofit import content_bbox
+
+SQUARE_POLICIES = ("pad", "crop", "stretch")
+SIDECAR_SUFFIX = ".recipe.json"
+
+
+def _crop_box(crop: Tuple[float, float, float, float], size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Pixel box of a normalized crop"""
+    w, h = size
+    left, top, right, bottom = crop
+    box = (int(left * w), int(top * h), round(right * w), round(bottom * h))
+    return max(0, box[0]), max(0, box[1]), min(w, max(box[0] + 1, box[2])), min(h, max(box[1] + 1, box[3]))
+
+
+def _square_geometry(policy: str, size: Tuple[int, int]):
+    """(side, crop box or None, paste offset) that makes an image of size square with the given policy"""
+    w, h = size
+    if policy == "crop":
+        side = min(w, h)
+        x, y = (w - side) // 2, (h - side) // 2
+        return side, (x, y, x + side, y + side), (0, 0)
+    side = max(w, h)
+    return side, None, ((side - w) // 2, (side - h) // 2)
+
+
+@dataclass(frozen=True)
+class Recipe:
+    crop: Optional[Tuple[float, float, float, float]] = None  # Left, top, right, bottom as fractions of the size
+    square: str = "pad"  # How non-square images become square, see SQUARE_POLICIES
+    background: Optional[Tuple[int, int, int, int]] = None  # RGBA fill behind transparent pixels, None keeps alpha
+    trim: bool = False  # Remove fully transparent borders before squaring
+    sharpen: bool = False  # Unsharp mask on the small icon sizes, see utils.save_ico
+
+    def __post_init__(self):
+        if self.square not in SQUARE_POLICIES:
+            raise ValueError(f"Square policy must be one of {', '.join(SQUARE_POLICIES)}, got '{self.square}'")
+        if self.crop is not None:
+            left, top, right, bottom = self.crop
+            if not 0 <= left < right <= 1 or not 0 <= top < bottom <= 1:
+                raise ValueError(f"Crop must be fractions with left < right and top < bottom, got {self.crop}")
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Recipe":
+        data = dict(data)
+        for key in ("crop", "background"):  # JSON has no tuples
+            if data.get(key) is not None:
+                data[key] = tuple(data[key])
+        return cls(**data)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def load(cls, path) -> "Recipe":
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def from_pixel_crop(cls, box: Optional[Tuple[int, int, int, int]], size: Tuple[int, int], **kwargs) -> "Recipe":
+        """Recipe with a crop given in pixels of an image of size, e.g. from utils.map_crop_box"""
+        if box is None:
+            return cls(**kwargs)
+        w, h = size
+        crop = (max(0.0, box[0] / w), max(0.0, box[1] / h), min(1.0, box[2] / w), min(1.0, box[3] / h))
+        return cls(crop=crop, **kwargs)
+
+    def crop_box(self, size: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
+        """Crop in pixels for an image of size, None if the recipe does not crop"""
+        return _crop_box(self.crop, size) if self.crop else None
+
+    def apply(self, img: Image.Image, cropped: bool = False) -> Image.Image:
+        """Transformed image, img itself if nothing changes. cropped tells that the crop was already applied,
+        e.g. by load_img_bounded."""
+        if self.crop and not cropped:
+            img = img.crop(self.crop_box(img.size))
+
+        img = img.convert("RGBA") if img.mode != "RGBA" else img
+        if self.trim:
+            bbox = content_bbox(img, tolerance=0, use_background=False)
+            if bbox is not None:
+                img = img.crop(bbox)
+
+        side, box, offset = _square_geometry(self.square, img.size)
+        if img.width == img.height:
+            pass
+        elif self.square == "stretch":
+            img = img.resize((side, side), Image.LANCZOS)
+        elif box is not None:
+            img = img.crop(box)
+        else:
+            padded = Image.new("RGBA", (side, side), (0, 0, 0, 0))
+            padded.paste(img, offset)
+            img = padded
+
+        if self.background is not None:
+            img = Image.alpha_composite(Image.new("RGBA", img.size, self.background), img)
+        return img
+
+
+def sidecar_path(output_path) -> str:
+    """Recipe file stored next to an ICO"""
+    return os.path.splitext(output_path)[0] + SIDECAR_SUFFIX
+
+
+def find_sidecar(output_path) -> Optional[Recipe]:
+    path = sidecar_path(output_path)
+    return Recipe.load(path) if os.path.exists(path) else None
@@ -0,0 +1,134 @@
+"""Persistent GUI session: queue, displayed image, per-image settings and a thumbnail index in one SQLite file.
+
+Thumbnails are stored as zlib compressed raw pixels keyed by path and size, together with the source mtime. A
+changed source misses the index and is decoded again. Reading a thumbnail back is a single indexed query and a
+decompress, much cheaper than decoding the source, so restoring a queue of hundreds of images is fast.
+"""
+import os
+import json
+import zlib
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from PIL import Image
+from recipes import Recipe
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS queue (position INTEGER PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS image_settings (path TEXT PRIMARY KEY, out_dir TEXT, file_name TEXT, recipe TEXT);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    path TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+    width INTEGER NOT NULL, height INTEGER NOT NULL, mode TEXT NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (path, size)
+);
+"""
+
+
+@dataclass
+class ImageSettings:
+    out_dir: str = ""
+    file_name: str = ""
+    recipe: Optional[Recipe] = None  # Crop and transforms, see recipes.Recipe
+
+
+@dataclass
+class Session:
+    queue: List[str] = field(default_factory=list)
+    displayed: Optional[str] = None
+    settings: Dict[str, ImageSettings] = field(default_factory=dict)  # Path -> settings
+
+
+def _mtime_ns(path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SessionStore:
+    """SQLite backed session file. Only use it from the thread that created it (the Tk mainloop)."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")  # Thumbnail writes do not block reads
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+        version = self._get_meta("schema_version")
+        if version is not None and int(version) != SCHEMA_VERSION:  # Old layout, start over
+            self._db.executescript("DROP TABLE meta; DROP TABLE queue; DROP TABLE image_settings; "
+                                   "DROP TABLE thumbnails;" + SCHEMA)
+        self._set_meta("schema_version", str(SCHEMA_VERSION))
+        self._db.commit()
+
+    def _get_meta(self, key) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value: str):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def save(self, session: Session):
+        """Replace the stored session. Thumbnails of images that are no longer part of it are dropped."""
+        paths = list(session.queue) + ([session.displayed] if session.displayed else [])
+        with self._db:  # One transaction
+            self._db.execute("DELETE FROM queue")
+            self._db.executemany("INSERT INTO queue (position, path) VALUES (?, ?)", enumerate(session.queue))
+            self._set_meta("displayed", json.dumps(session.displayed))
+
+            self._db.execute("DELETE FROM image_settings")
+            self._db.executemany(
+                "INSERT INTO image_settings (path, out_dir, file_name, recipe) VALUES (?, ?, ?, ?)",
+                [(path, s.out_dir, s.file_name, json.dumps(s.recipe.to_dict()) if s.recipe else None)
+                 for path, s in session.settings.items()])
+
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS keep (path TEXT PRIMARY KEY)")
+            self._db.execute("DELETE FROM keep")
+            self._db.executemany("INSERT OR IGNORE INTO keep (path) VALUES (?)", [(p,) for p in paths])
+            self._db.execute("DELETE FROM thumbnails WHERE path NOT IN (SELECT path FROM keep)")
+
+    def load(self) -> Session:
+        """The stored session, without images that no longer exist"""
+        queue = [path for path, in self._db.execute("SELECT path FROM queue ORDER BY position")
+                 if os.path.isfile(path)]
+        displayed = json.loads(self._get_meta("displayed") or "null")
+        if displayed is not None and not os.path.isfile(displayed):
+            displayed = None
+
+        settings = {}
+        for path, out_dir, file_name, recipe in self._db.execute("SELECT * FROM image_settings"):
+            recipe = Recipe.from_dict(json.loads(recipe)) if recipe else None
+            settings[path] = ImageSettings(out_dir or "", file_name or "", recipe)
+        return Session(queue, displayed, settings)
+
+    def get_thumbnail(self, path, size: int) -> Optional[Image.Image]:
+        """Stored thumbnail of path, None if there is none or the file changed since it was stored"""
+        row = self._db.execute("SELECT mtime_ns, width, height, mode, data FROM thumbnails WHERE path = ? AND size = ?",
+                               (path, size)).fetchone()
+        if row is None or row[0] != _mtime_ns(path):
+            return None
+        _, width, height, mode, data = row
+        return Image.frombytes(mode, (width, height), zlib.decompress(data))
+
+    def put_thumbnail(self, path, size: int, img: Image.Image):
+        """Store a thumbnail. Written to disk with the next save() or flush()."""
+        mtime_ns = _mtime_ns(path)
+        if mtime_ns is None:
+            return
+        if img.mode not in ("L", "LA", "RGB", "RGBA"):  # Raw bytes can not carry a palette
+            img = img.convert("RGBA")
+        self._db.execute("INSERT OR REPLACE INTO thumbnails (path, size, mtime_ns, width, height, mode, data) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (path, size, mtime_ns, img.width, img.height, img.mode, zlib.compress(img.tobytes(), 1)))
+
+    def flush(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
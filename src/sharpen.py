@@ -0,0 +1,135 @@
+"""Post-processing of the small icon sizes, which come out soft after a generic downscale.
+
+Three steps, each tuned per size through a SharpenProfile:
+  - Pixel-grid snapping: a size that divides a larger frame (16 of 32, 24 of 48) is rebuilt from that frame with an
+    integer box reduction, so edges stay on whole pixels instead of being smeared by a fractional resample.
+  - Unsharp mask: all small frames are packed into one atlas with edge-replicated gutters and filtered in a single
+    pass with a precomputed 5x5 kernel. The per-size strength is applied afterwards by extrapolating between the
+    original and the sharpened frame, which is a cheap per-pixel blend.
+  - Alpha cleanup: nearly transparent and nearly opaque alpha values are snapped to 0 and 255, removing the faint
+    fringes that show up as dirt on small icons.
+"""
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+from PIL import Image, ImageFilter
+
+SHARPEN_VERSION = 1  # Bump when the output of sharpen_frames changes, it is part of the ICO cache key
+KERNEL_RADIUS = 2  # 5x5 kernels, the largest size ImageFilter.Kernel supports
+
+
+@dataclass(frozen=True)
+class SharpenProfile:
+    amount: float  # Unsharp mask strength, 0 disables it
+    alpha_low: int = 0  # Alpha at or below this becomes fully transparent
+    alpha_high: int = 255  # Alpha at or above this becomes fully opaque
+
+
+DEFAULT_PROFILES = {
+    16: SharpenProfile(1.0, alpha_low=40, alpha_high=215),
+    24: SharpenProfile(0.8, alpha_low=32, alpha_high=223),
+    32: SharpenProfile(0.6, alpha_low=24, alpha_high=231),
+    48: SharpenProfile(0.4, alpha_low=16, alpha_high=239),
+}
+
+
+@dataclass
+class SharpenSettings:
+    profiles: Dict[int, SharpenProfile] = field(default_factory=lambda: dict(DEFAULT_PROFILES))
+    sigma: float = 0.7  # Blur radius of the unsharp mask in pixels of the target size
+    snap: bool = True  # Rebuild sizes that divide a larger frame with an integer reduction
+
+    def profile_for(self, size: int) -> Optional[SharpenProfile]:
+        """Profile of the smallest configured size that is at least size, None for sizes above all of them"""
+        larger = [s for s in self.profiles if s >= size]
+        return self.profiles[min(larger)] if larger else None
+
+
+@lru_cache(maxsize=16)
+def unsharp_kernel(sigma: float) -> ImageFilter.Kernel:
+    """5x5 kernel of 2 * identity - gaussian, i.e. an unsharp mask with amount 1. Computed once per sigma."""
+    weights = [math.exp(-(x * x) / (2 * sigma * sigma)) for x in range(-KERNEL_RADIUS, KERNEL_RADIUS + 1)]
+    total = sum(weights)
+    weights = [w / total for w in weights]
+
+    side = 2 * KERNEL_RADIUS + 1
+    kernel = [-weights[y] * weights[x] for y in range(side) for x in range(side)]
+    kernel[len(kernel) // 2] += 2
+    return ImageFilter.Kernel((side, side), kernel, scale=1)
+
+
+@lru_cache(maxsize=64)
+def alpha_lut(low: int, high: int) -> List[int]:
+    return [0 if a <= low else 255 if a >= high else a for a in range(256)]
+
+
+def snap_to_grid(frames: List[Image.Image], max_size: int, max_factor: int = 4) -> List[Image.Image]:
+    """Rebuild frames up to max_size from the smallest larger frame whose size is an integer multiple"""
+    by_size = {f.width: f for f in frames}
+    snapped = []
+    for frame in frames:
+        size = frame.width
+        sources = [s for s in sorted(by_size) if size < s <= size * max_factor and s % size == 0]
+        if size <= max_size and sources:
+            frame = by_size[sources[0]].reduce(sources[0] // size)
+        snapped.append(frame)
+    return snapped
+
+
+def _edge_padded(img: Image.Image, gutter: int) -> Image.Image:
+    """img with its border pixels repeated gutter times on every side, so filtering sees no foreign pixels"""
+    w, h = img.size
+    padded = Image.new(img.mode, (w + 2 * gutter, h + 2 * gutter))
+    padded.paste(img, (gutter, gutter))
+    padded.paste(img.crop((0, 0, w, 1)).resize((w, gutter)), (gutter, 0))
+    padded.paste(img.crop((0, h - 1, w, h)).resize((w, gutter)), (gutter, h + gutter))
+    full_h = h + 2 * gutter
+    padded.paste(padded.crop((gutter, 0, gutter + 1, full_h)).resize((gutter, full_h)), (0, 0))
+    padded.paste(padded.crop((w + gutter - 1, 0, w + gutter, full_h)).resize((gutter, full_h)), (w + gutter, 0))
+    return padded
+
+
+def _sharpen_atlas(frames: List[Image.Image], kernel: ImageFilter.Kernel) -> List[Image.Image]:
+    """RGB of every frame filtered with kernel in one pass over a horizontal atlas"""
+    gutter = KERNEL_RADIUS
+    width = sum(f.width + 2 * gutter for f in frames)
+    height = max(f.height for f in frames) + 2 * gutter
+    atlas = Image.new("RGB", (width, height))
+
+    boxes = []
+    x = 0
+    for frame in frames:
+        atlas.paste(_edge_padded(frame.convert("RGB"), gutter), (x, 0))
+        boxes.append((x + gutter, gutter, x + gutter + frame.width, gutter + frame.height))
+        x += frame.width + 2 * gutter
+
+    atlas = atlas.filter(kernel)
+    return [atlas.crop(box) for box in boxes]
+
+
+def sharpen_frames(frames: List[Image.Image], settings: Optional[SharpenSettings] = None) -> List[Image.Image]:
+    """Snap, sharpen and clean up all frames that have a profile. Order and larger frames are kept."""
+    settings = settings or SharpenSettings()
+    if not settings.profiles:
+        return frames
+
+    if settings.snap:
+        frames = snap_to_grid(frames, max(settings.profiles))
+
+    small = [(i, f, settings.profile_for(f.width)) for i, f in enumerate(frames)]
+    small = [(i, f.convert("RGBA") if f.mode != "RGBA" else f, p) for i, f, p in small if p is not None]
+    if not small:
+        return frames
+
+    sharpened = _sharpen_atlas([f for _, f, _ in small], unsharp_kernel(settings.sigma))
+
+    result = list(frames)
+    for (i, frame, profile), sharp_rgb in zip(small, sharpened):
+        *rgb, alpha = frame.split()
+        rgb = Image.merge("RGB", rgb)
+        if profile.amount:  # Extrapolate from the original towards the amount 1 result
+            rgb = Image.blend(rgb, sharp_rgb, profile.amount)
+        alpha = alpha.point(alpha_lut(profile.alpha_low, profile.alpha_high))
+        result[i] = Image.merge("RGBA", (*rgb.split(), alpha))
+    return result
@@ -1,14 +1,12 @@
-from PIL import IcoImagePlugin, Image
+from ico import read_directory
 
-icon = Image.open(r"./imgs/icon_edited.ico")
+# Only the directory table is read, no image is decoded
+entries = read_directory(r"./imgs/icon_edited.ico")
 
-
-# Get the list of available sizes from the .ico file metadata
-sizes = icon.info.get('sizes', [])
-
-if sizes:
+if len(entries) > 1:
     print("Sizes embedded in .ico file:")
-    for size in sizes:
-        print(size)
+    for entry in entries:
+        print(f"{entry.width}x{entry.height}, {entry.bit_count} bit, {entry.encoding}, "
+              f"{entry.size} bytes at offset {entry.offset}")
 else:
-    print("Only one size available:", icon.size)
+    print("Only one size available:", (entries[0].width, entries[0].height))
@@ -0,0 +1,54 @@
+import os
+from folder_icons import (deploy_folder_icons, desktop_ini_content, RecordingAttributeBackend,
+                          FILE_ATTRIBUTE_HIDDEN, FILE_ATTRIBUTE_READONLY, FILE_ATTRIBUTE_SYSTEM)
+
+
+def make_folders(root, *names):
+    folders = [os.path.join(root, name) for name in names]
+    for folder in folders:
+        os.makedirs(folder)
+    return folders
+
+
+def read_ini(folder):
+    with open(os.path.join(folder, "desktop.ini")) as f:
+        return f.read()
+
+
+def test_writes_ini_and_sets_attributes(tmp_path):
+    a, b = make_folders(tmp_path, "a", "b")
+    backend = RecordingAttributeBackend()
+
+    results = deploy_folder_icons({a: "a.ico", b: "b.ico"}, backend=backend)
+
+    assert [r.status for r in results] == ["written", "written"]
+    assert read_ini(a) == desktop_ini_content("a.ico")
+    assert read_ini(b) == desktop_ini_content("b.ico")
+    assert (os.path.join(a, "desktop.ini"), FILE_ATTRIBUTE_HIDDEN | FILE_ATTRIBUTE_SYSTEM) in backend.calls
+    assert (a, FILE_ATTRIBUTE_READONLY) in backend.calls
+    assert sorted(os.listdir(a)) == ["desktop.ini"]  # No temp file left behind
+
+
+def test_skips_up_to_date_folders(tmp_path):
+    a, b = make_folders(tmp_path, "a", "b")
+    deploy_folder_icons({a: "a.ico"}, backend=RecordingAttributeBackend())
+    backend = RecordingAttributeBackend()
+
+    results = deploy_folder_icons({a: "a.ico", b: "b.ico"}, backend=backend)
+
+    assert [r.status for r in results] == ["skipped", "written"]
+    assert not any(path.startswith(a) for path, _ in backend.calls)
+
+
+def test_abort_changes_nothing_and_keeps_up_to_date_folders_skipped(tmp_path):
+    a, b = make_folders(tmp_path, "a", "b")
+    deploy_folder_icons({b: "b.ico"}, backend=RecordingAttributeBackend())
+    missing = os.path.join(tmp_path, "missing")
+
+    # The failing folder comes first, b is checked after it in the mapping order
+    results = deploy_folder_icons({missing: "m.ico", a: "a.ico", b: "b.ico"}, backend=RecordingAttributeBackend())
+
+    assert [r.status for r in results] == ["failed", "failed", "skipped"]
+    assert "Batch aborted" in results[1].error
+    assert os.listdir(a) == []
+    assert read_ini(b) == desktop_ini_content("b.ico")
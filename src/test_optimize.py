@@ -0,0 +1,51 @@
+import io
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+from ico import IcoFile
+from ico_writer import EncodeOptions
+
+SIZES = [16, 24, 32, 48, 64, 128, 256]
+
+
+def ellipse(size: int, colors: int) -> Image.Image:
+    """Transparent background with an ellipse of concentric rings in a few flat colors"""
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for i in range(colors):
+        inset = i * (size // 4) // colors
+        draw.ellipse((inset, inset + size // 8, size - 1 - inset, size - 1 - inset - size // 8),
+                     fill=(40 * i % 256, 255 - 30 * i % 256, 90, 255))
+    return img
+
+
+def visible(img: Image.Image) -> Image.Image:
+    """RGBA with fully transparent pixels set to (0, 0, 0, 0), their color is not stored by palette entries"""
+    img = img.convert("RGBA")
+    return Image.composite(img, Image.new("RGBA", img.size, (0, 0, 0, 0)), img.getchannel("A"))
+
+
+@pytest.mark.parametrize("colors", [3, 40])
+def test_optimized_ico_decodes_to_the_source(colors):
+    frames = {size: ellipse(size, colors) for size in SIZES}
+    ico = IcoFile()
+    for frame in frames.values():
+        ico.add(frame, EncodeOptions(optimize=True))
+    data = ico.to_bytes()
+
+    with Image.open(io.BytesIO(data)) as packed:
+        for size, frame in frames.items():
+            packed.size = (size, size)
+            packed.load()
+            assert ImageChops.difference(visible(packed), visible(frame)).getbbox() is None, size
+    for size, frame in frames.items():
+        assert ImageChops.difference(visible(IcoFile.load(data).image(size)), visible(frame)).getbbox() is None, size
+
+
+def test_optimized_png_entries_stay_rgba():
+    ico = IcoFile()
+    ico.add(ellipse(64, 3), EncodeOptions(optimize=True))
+    entry = ico.get(64)
+
+    assert entry.encoding == "png" and entry.bit_count == 32
+    with Image.open(io.BytesIO(entry.data)) as png:
+        assert png.mode == "RGBA"
@@ -0,0 +1,120 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+from PIL import Image
+from utils import load_img
+
+ThumbKey = Tuple[str, float]  # (path, mtime), a changed file gets a new key
+
+
+def image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+
+class ThumbnailService:
+    """Decodes thumbnails in worker threads and keeps them in an LRU cache bounded by decoded bytes.
+
+    Callbacks are never called from a worker thread. Finished decodes are queued and delivered by poll(), which
+    the GUI calls from the mainloop (e.g. with after()), so callbacks can safely create Tk images.
+    An optional persistent index (see session.SessionStore) is checked before decoding and filled with every
+    decoded thumbnail. It is only used from the thread calling request() and poll().
+    """
+
+    def __init__(self, size: int, max_bytes: int = 32 * 1024 * 1024, max_workers: int = 4, index=None):
+        self.size = size
+        self.index = index
+        self.max_bytes = max_bytes
+        self.cache_bytes = 0
+
+        self._cache: "OrderedDict[ThumbKey, Image.Image]" = OrderedDict()
+        self._pending = {}  # ThumbKey -> list of callbacks waiting for that decode
+        self._done = queue.Queue()
+        self._lock = threading.Lock()  # Guards the cache, which other threads may read through get_cached
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+
+    @staticmethod
+    def make_key(path) -> Optional[ThumbKey]:
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return None
+
+    def get_cached(self, path) -> Optional[Image.Image]:
+        key = self.make_key(path)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def put(self, key: ThumbKey, img: Image.Image):
+        """Insert a decoded thumbnail and evict least recently used entries until the byte budget is met."""
+        with self._lock:
+            if key in self._cache:
+                self.cache_bytes -= image_nbytes(self._cache.pop(key))
+            self._cache[key] = img
+            self.cache_bytes += image_nbytes(img)
+
+            while self.cache_bytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self.cache_bytes -= image_nbytes(evicted)
+
+    def request(self, path, callback: Callable[[str, Optional[Image.Image]], None]):
+        """Ask for the thumbnail of path. callback(path, img) runs immediately on a cache hit, otherwise from poll().
+
+        img is None if the file could not be decoded.
+        """
+        key = self.make_key(path)
+        if key is None:
+            callback(path, None)
+            return
+
+        cached = self.get_cached(path)
+        if cached is None and self.index is not None:
+            cached = self.index.get_thumbnail(path, self.size)
+            if cached is not None:
+                self.put(key, cached)
+        if cached is not None:
+            callback(path, cached)
+            return
+
+        if key in self._pending:  # Decode already running, just wait for it
+            self._pending[key].append(callback)
+            return
+
+        self._pending[key] = [callback]
+        self._executor.submit(self._decode, key)
+
+    def _decode(self, key: ThumbKey):
+        try:
+            img = load_img(key[0], set_size=self.size)
+            img.load()
+        except Exception as e:
+            print("Could not load thumbnail:", e)
+            img = None
+        self._done.put((key, img))
+
+    def poll(self) -> int:
+        """Deliver finished decodes to their callbacks. Returns the number of delivered thumbnails."""
+        delivered = 0
+        while True:
+            try:
+                key, img = self._done.get_nowait()
+            except queue.Empty:
+                break
+
+            if img is not None:
+                self.put(key, img)
+                if self.index is not None:
+                    self.index.put_thumbnail(key[0], self.size, img)
+            for callback in self._pending.pop(key, []):
+                callback(key[0], img)
+            delivered += 1
+
+        return delivered
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
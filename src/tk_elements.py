@@ -3,7 +3,12 @@ from tkinterdnd2 import DND_FILES  # https://pypi.org/project/tkinterdnd2/
 from typing import Optional, Callable, Tuple, Union, List
 from dataclasses import dataclass
 from tkinter import ttk
+from tkinter.font import Font
 from PIL import Image, ImageTk
+from document import ImageDocument
+from utils import map_crop_box, unmap_crop_box
+from recipes import Recipe
+from profiling import emit
 
 
 @dataclass
@@ -149,6 +154,88 @@ class DnDFileCanvas(tk.Canvas):
             self.dnd_bind('<<Drop>>', on_drop)
 
 
+class QueueGrid(tk.Frame):
+    """Grid of queue thumbnails with a fixed pool of cells.
+
+    Cells are created once and only reconfigured when the path they show changes, so updates cost at most one
+    config call per visible cell instead of rebuilding every widget.
+    """
+
+    def __init__(self, master=None, cell_size: int = 50, cols: int = 4, rows: int = 6, cell_bg: str = "grey",
+                 on_clear: Optional[Callable] = None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.cols = cols
+        self.rows = rows
+        self.capacity = cols * rows
+
+        self._cell_content = [None] * self.capacity  # Path, overflow text or None per cell
+        self._path_to_cell = {}
+        self._labels = []
+
+        for i in range(self.capacity):
+            elem_frame = tk.Frame(self, width=cell_size, height=cell_size, bg=self.cget("bg"))
+            elem_frame.grid(row=i // cols, column=cols - i % cols)
+            elem_frame.pack_propagate(False)
+            elem_frame.grid_remove()  # grid() later restores the position set here
+
+            label = tk.Label(elem_frame, bg=cell_bg, font=Font(size=10, weight="bold"))
+            label.pack(padx=1, pady=1, anchor="center", fill="both", expand=True)
+            self._labels.append(label)
+
+        self.clear_btn = BorderBtn(self, text="Clear Queue", command=on_clear, palette=BtnPalette.red_light(),
+                                   border_width=1)
+        self.clear_btn.grid(row=rows + 1, column=1, columnspan=cols, sticky="ew", padx=1, pady=1)
+        self.clear_btn.grid_remove()
+
+    def show(self, paths: List[str], overflow: int = 0, images: Optional[dict] = None):
+        """Display paths in order. A positive overflow replaces the last used cell with a "+overflow" counter."""
+        images = images or {}
+        contents = list(paths[:self.capacity])
+        overflow_cell = None
+        if overflow > 0:
+            contents = contents[:self.capacity - 1] + [f"+{overflow}"]
+            overflow_cell = len(contents) - 1
+        contents += [None] * (self.capacity - len(contents))
+
+        for i, content in enumerate(contents):
+            if content == self._cell_content[i]:
+                continue
+
+            old = self._cell_content[i]
+            if old is not None and self._path_to_cell.get(old) == i:
+                del self._path_to_cell[old]
+
+            label = self._labels[i]
+            if content is None:
+                label.master.grid_remove()
+            elif i == overflow_cell:
+                label.config(image="", text=content)
+                label.master.grid()
+            else:
+                label.config(image=images.get(content, ""), text="")
+                self._path_to_cell[content] = i
+                label.master.grid()
+
+            self._cell_content[i] = content
+
+        if contents[0] is None:
+            self.clear_btn.grid_remove()
+        else:
+            self.clear_btn.grid()
+
+    @property
+    def visible_paths(self):
+        return self._path_to_cell.keys()
+
+    def set_image(self, path, tk_img):
+        """Update the thumbnail of a visible path. Returns False if the path is not shown."""
+        cell = self._path_to_cell.get(path)
+        if cell is None:
+            return False
+        self._labels[cell].config(image=tk_img)
+        return True
+
+
 class MultiCheckSelector(tk.Frame):
     def __init__(self, parent, values, defaults: Union[List[bool], bool] = True, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
@@ -177,6 +264,7 @@ class CropCanvas(DnDFileCanvas):
 
         # Image state
         self.displayed_img_path = None
+        self.document: Optional[ImageDocument] = None  # Shared with the App, owns the decoded source
         self.tk_img = None
         self.preview_size = kwargs.get("width", 320)  # fallback
 
@@ -233,24 +321,42 @@ class CropCanvas(DnDFileCanvas):
             x1, y1, x2, y2 = self.coords(self.crop_rect)
             self.crop_box = (min(x1, x2), min(y1, y2),
                              max(x1, x2), max(y1, y2))
-            print("Crop box set:", self.crop_box)
+            emit("crop.set", box=self.crop_box)
 
     def set_image(self, img_path, preview_size=None):
         """Load and display an image in the canvas"""
-        from utils import load_img  # your existing helper
         if preview_size:
             self.preview_size = preview_size
-        img = load_img(img_path, set_size=self.preview_size)
-        self.tk_img = ImageTk.PhotoImage(img)
+        if self.document is not None:
+            self.document.close()
+        self.document = ImageDocument(img_path)
+        self.tk_img = ImageTk.PhotoImage(self.document.preview(self.preview_size))
         center = int(self.preview_size / 2)
         self.create_image(center, center, anchor=tk.CENTER, image=self.tk_img)
         self.displayed_img_path = img_path
 
+    def get_recipe(self, **kwargs) -> Recipe:
+        """Current crop as a recipe that can be applied to other images. kwargs set the other recipe fields."""
+        if self.document is None or not self.crop_box:
+            return Recipe(**kwargs)
+        size = self.document.size  # Header only, nothing is decoded
+        return Recipe.from_pixel_crop(map_crop_box(self.crop_box, size, self.preview_size), size, **kwargs)
+
+    def set_recipe_crop(self, recipe: Recipe):
+        """Show the crop of a recipe, e.g. one restored from a saved session. Crop mode must be enabled."""
+        if self.document is None or not recipe.crop:
+            return
+        size = self.document.size
+        self.crop_box = unmap_crop_box(recipe.crop_box(size), size, self.preview_size)
+        if self.crop_rect:
+            self.delete(self.crop_rect)
+        self.crop_rect = self.create_rectangle(*self.crop_box, outline="red", width=2, dash=(4, 2))
+
     def get_cropped_image(self, min_size=256):
-        if not self.displayed_img_path:
+        if self.document is None:
             return None
 
-        img = Image.open(self.displayed_img_path)
+        img = self.document.image  # Decoded once per document, shared with the App
         orig_w, orig_h = img.size
 
         if not self.crop_box:
@@ -258,28 +364,9 @@ class CropCanvas(DnDFileCanvas):
             if img.width < min_size or img.height < min_size:
                 img = img.resize((max(min_size, img.width), max(min_size, img.height)), resample=Image.LANCZOS)
 
-            return img
-
-        # Determine displayed image size on the canvas
-        canvas_w = self.preview_size
-        canvas_h = self.preview_size
-        scale = min(canvas_w / orig_w, canvas_h / orig_h)
-        disp_w = int(orig_w * scale)
-        disp_h = int(orig_h * scale)
-
-        # Compute offsets (if image is centered in canvas)
-        offset_x = (canvas_w - disp_w) // 2
-        offset_y = (canvas_h - disp_h) // 2
-
-        # Map canvas crop box to original image coordinates
-        x1, y1, x2, y2 = self.crop_box
-        real_box = (
-            int((x1 - offset_x) / scale),
-            int((y1 - offset_y) / scale),
-            round((x2 - offset_x) / scale),  # use round for right/bottom
-            round((y2 - offset_y) / scale)
-        )
+            return img  # May be the document's own image, which save_ico does not modify
 
+        real_box = map_crop_box(self.crop_box, (orig_w, orig_h), self.preview_size)
         cropped_img = img.crop(real_box)
 
         # If the crop is smaller than minimum size, scale it up
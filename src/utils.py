@@ -1,63 +1,342 @@
-import os
-import ctypes
-from PIL import Image
-from typing import Optional, List
+import io
+import math
+from functools import lru_cache
+from PIL import Image, ExifTags
+from typing import Optional, List, Union, Dict, Tuple, Iterator
+from profiling import stage, emit
+from frames import FrameSelector, frame_count, iter_frames, select_frame
+from ico_writer import write_ico, EncodeOptions
+from folder_icons import deploy_folder_icons
+from autofit import content_bbox, pad_to_square
+from sharpen import SharpenSettings, sharpen_frames
 
+VALID_IMG_TYPES = ("jpg", "jpeg", "png", "webp", "gif")
 
-def convert_to_ico(pil_obj, output_path, sizes: Optional[List[int]] = None):
 
-    max_size = 256  # Max size that windows supports
+COMMON_SIZES = [16, 24, 32, 48, 64, 128, 256]
+MAX_ICO_SIZE = 256  # Max size that windows supports
 
-    if sizes is not None:
-        dim_sizes = [(s, s) for s in sizes]
-    else:  # Pick Common sizes
-        dim_sizes = [(16, 16), (24, 24), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256)]
+# Quality/speed presets for the resize pyramid, usable as a single filter or per size
+RESAMPLE_QUALITY = Image.LANCZOS
+RESAMPLE_FAST = Image.BILINEAR
 
-    try:
-        # Open and resize image
-        img = pil_obj
-        img.thumbnail((max_size, max_size), Image.LANCZOS)  # Keeps aspect ratio
-        width, height = img.size
-
-        if width == height:  # Square src image
-            transparent_img = img.convert('RGBA')
-        elif width > height:
-            transparent_img = Image.new('RGBA', (max_size, max_size), (255, 0, 0, 0))
-            transparent_img.paste(img, (0, int((width-height)/2)))
+
+def resolve_resample(resample: Union[int, Dict[int, int], None], size: int) -> int:
+    """Resample filter for a given target size. Sizes missing from a dict fall back to the quality filter."""
+    if resample is None:
+        return RESAMPLE_QUALITY
+    if isinstance(resample, dict):
+        return resample.get(size, RESAMPLE_QUALITY)
+    return resample
+
+
+def build_resize_pyramid(master, sizes: List[int], resample: Union[int, Dict[int, int], None] = None):
+    """Create one square frame per size, each resampled from the nearest larger frame instead of the master.
+
+    Sizes larger than the master are skipped. Returns the frames ordered from large to small.
+    """
+    frames = []
+    source = master
+
+    for size in sorted(set(sizes), reverse=True):
+        if size > master.width:
+            continue
+        if size == source.width:
+            frame = source
         else:
-            transparent_img = Image.new('RGBA', (max_size, max_size), (255, 0, 0, 0))
-            transparent_img.paste(img, (int((height-width)/2), 0))
+            frame = source.resize((size, size), resolve_resample(resample, size))
+        frames.append(frame)
+        source = frame
+
+    return frames
+
+
+def save_ico(pil_obj, output_path, sizes: Optional[List[int]] = None,
+             resample: Union[int, Dict[int, int], None] = None, source: Optional[str] = None,
+             encode_options: Optional[EncodeOptions] = None, sharpen: Union[bool, SharpenSettings] = False,
+             fit: bool = False):
+    """Convert the image to a multi-size ICO file. Raises on failure, see convert_to_ico for the lenient variant.
+
+    output_path can also be a writable binary file object, e.g. an HTTP response or an open archive member.
+    resample selects the filter for the pyramid levels, either one filter for all sizes or a dict of size to filter.
+    source labels the timing events, it defaults to the file name of the image.
+    encode_options selects PNG or BMP entries per size and the PNG compression, see ico_writer.
+    sharpen post-processes the small sizes, which come out soft after downscaling: True for the default per-size
+    profiles or a SharpenSettings, see sharpen.sharpen_frames.
+    fit crops transparent or uniform borders before padding to a square, see autofit.auto_fit.
+    """
+
+    if sizes is None:  # Pick Common sizes
+        sizes = COMMON_SIZES
+    dim_sizes = [(s, s) for s in sizes]
+    max_size = min(max(sizes), MAX_ICO_SIZE)
+
+    source = source or getattr(pil_obj, "filename", "") or None  # Only set for images opened from a file
+    img = pil_obj
+
+    with stage("convert.decode", source=source):
+        img.load()  # No-op for decoded images, use load_img_bounded for a reduced decode of large sources
+
+    if fit:
+        with stage("convert.autofit", source=source):
+            bbox = content_bbox(img)
+            if bbox is not None:
+                img = img.crop(bbox)
+
+    with stage("convert.thumbnail", source=source, size=img.size):
+        # Same as thumbnail(), but returns a new image so the caller's object is left untouched
+        scale = min(max_size / img.width, max_size / img.height)
+        if scale < 1:
+            new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            img = img.resize(new_size, resolve_resample(resample, max_size), reducing_gap=2.0)
+    width, height = img.size
+
+    with stage("convert.pad", source=source):
+        # Centered on a square of the longest edge, so sources smaller than max_size are not off-center
+        transparent_img = pad_to_square(img)
+
+    # All sizes are prepared here, the ICO writer stores the frames as they are
+    with stage("convert.resample", source=source, sizes=sizes):
+        frames = build_resize_pyramid(transparent_img, sizes, resample=resample)
+    if not frames:
+        raise ValueError(f"Image of size {img.size} is smaller than all requested sizes {sizes}")
+
+    if sharpen:
+        with stage("convert.sharpen", source=source):
+            frames = sharpen_frames(frames, sharpen if isinstance(sharpen, SharpenSettings) else None)
+
+    # Outpath variable is expected to have ".ico"
+    with stage("convert.encode", source=source):
+        entries = write_ico(frames, output_path, encode_options)
 
-        transparent_img.save(output_path, sizes=dim_sizes)  # Outpath variable is expected to have ".ico"
-        print("Created ICO file with sizes:", dim_sizes)
+    if encode_options is not None and encode_options.optimize:
+        saved = sum(e.original_size - len(e.data) for e in entries if e.original_size is not None)
+        emit("convert.optimized", source=source, bytes_saved=saved,
+             per_size={e.width: e.original_size - len(e.data) for e in entries if e.original_size is not None})
+    return dim_sizes
+
+
+def encode_ico(pil_obj, sizes: Optional[List[int]] = None, resample: Union[int, Dict[int, int], None] = None,
+               as_memoryview: bool = False, encode_options: Optional[EncodeOptions] = None) -> Union[bytes, memoryview]:
+    """Encode the image as ICO in memory. as_memoryview avoids copying the encoded buffer."""
+    buffer = io.BytesIO()
+    save_ico(pil_obj, buffer, sizes=sizes, resample=resample, encode_options=encode_options)
+    return buffer.getbuffer() if as_memoryview else buffer.getvalue()
+
+
+def convert_to_ico(pil_obj, output_path, sizes: Optional[List[int]] = None,
+                   sharpen: Union[bool, SharpenSettings] = False):
+
+    try:
+        dim_sizes = save_ico(pil_obj, output_path, sizes=sizes, sharpen=sharpen)
+        emit("convert.created", output=output_path, sizes=dim_sizes)
+        return True
 
     except Exception as e:
-        print("Error when saving as ICO:", e)
+        emit("convert.error", output=output_path, error=e)
+        return False
+
+
+def map_crop_box(crop_box, orig_size, preview_size):
+    """Map a crop box in preview canvas coordinates to coordinates in the original image.
+
+    The preview is expected to be scaled to fit a square canvas of preview_size and centered in it.
+    """
+    orig_w, orig_h = orig_size
+
+    # Determine displayed image size on the canvas
+    canvas_w = preview_size
+    canvas_h = preview_size
+    scale = min(canvas_w / orig_w, canvas_h / orig_h)
+    disp_w = int(orig_w * scale)
+    disp_h = int(orig_h * scale)
+
+    # Compute offsets (if image is centered in canvas)
+    offset_x = (canvas_w - disp_w) // 2
+    offset_y = (canvas_h - disp_h) // 2
+
+    # Map canvas crop box to original image coordinates
+    x1, y1, x2, y2 = crop_box
+    return (
+        int((x1 - offset_x) / scale),
+        int((y1 - offset_y) / scale),
+        round((x2 - offset_x) / scale),  # use round for right/bottom
+        round((y2 - offset_y) / scale)
+    )
+
+
+def unmap_crop_box(box, orig_size, preview_size):
+    """Inverse of map_crop_box: a box in original image coordinates to preview canvas coordinates"""
+    orig_w, orig_h = orig_size
+    scale = min(preview_size / orig_w, preview_size / orig_h)
+    offset_x = (preview_size - int(orig_w * scale)) // 2
+    offset_y = (preview_size - int(orig_h * scale)) // 2
+
+    x1, y1, x2, y2 = box
+    return x1 * scale + offset_x, y1 * scale + offset_y, x2 * scale + offset_x, y2 * scale + offset_y
 
 
 def set_folder_icon(folder_path, icon_path):
-    desktop_ini = os.path.join(folder_path, "desktop.ini")
+    """Set the icon of a single folder, see folder_icons.deploy_folder_icons for many folders at once"""
+    result = deploy_folder_icons({folder_path: icon_path})[0]
+    if result.status == "failed":
+        raise OSError(f"Could not set folder icon of {folder_path}: {result.error}")
+
+
+class MemoryBudgetExceeded(Exception):
+    """The decoded image would not fit into the configured memory budget"""
+
+
+def estimate_decoded_bytes(image, animated_frame: bool = False) -> int:
+    """Bytes the decoded bitmap will need, from the header of a lazily opened image.
 
-    # Remove desktop.ini if already there
-    if os.path.exists(desktop_ini):
-        os.remove(desktop_ini)
+    Selected frames of animations are converted to RGBA, so they need 4 bytes per pixel.
+    """
+    bands = 4 if animated_frame else len(image.getbands())
+    return image.width * image.height * bands
 
-    # Write the configuration to the desktop.ini file
-    with open(desktop_ini, "w") as f:
-        f.write(f"[.ShellClassInfo]\n"
-                f"IconResource={icon_path},0\n"
-                f"IconFile=%SystemRoot%\\system32\\SHELL32.dll\n"
-                f"IconIndex=0\n")
 
-    # Set the desktop.ini file as hidden and system
-    ctypes.windll.kernel32.SetFileAttributesW(desktop_ini, 6)
+def _decode_scale(path, image, max_bytes: Optional[int], target_size: Optional[int],
+                  crop_box: Optional[Tuple[int, int, int, int]], animated_frame: bool) -> float:
+    """Scale to decode image at, raises MemoryBudgetExceeded if even that does not fit into max_bytes"""
+    region_w, region_h = (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]) if crop_box else image.size
 
-    # Set the folder as read-only
-    ctypes.windll.kernel32.SetFileAttributesW(folder_path, 1)
+    scale = 1.0
+    if target_size:  # Keep twice the target size, like thumbnail() does, so the final resample has detail
+        scale = min(scale, 2 * target_size / max(region_w, region_h, 1))
+    if max_bytes:
+        budget_scale = (max_bytes / max(estimate_decoded_bytes(image, animated_frame), 1)) ** 0.5
+        if budget_scale < scale:
+            # draft() rounds up to the next DCT scale (1/2, 1/4, 1/8), so round down to stay inside the budget
+            scale = 2 ** math.floor(math.log2(budget_scale)) if budget_scale > 0 else 0
 
+    if scale < 1 and image.format == "JPEG":
+        image.draft(image.mode, (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
 
-def load_img(path, set_size: Optional[int]):
+    estimate = estimate_decoded_bytes(image, animated_frame)
+    if max_bytes and estimate > max_bytes:
+        raise MemoryBudgetExceeded(f"Decoding {path} needs about {estimate / 2**20:.0f}MB, "
+                                   f"the budget is {max_bytes / 2**20:.0f}MB")
+    return scale
+
+
+def _reduce_and_crop(image: Image.Image, orig_size: Tuple[int, int], scale: float,
+                     crop_box: Optional[Tuple[int, int, int, int]]) -> Image.Image:
+    """Decoded image reduced to scale of orig_size and cropped to crop_box, given in original coordinates"""
+    orig_w, orig_h = orig_size
+    factor = int(image.width / max(orig_w * scale, 1))  # Remaining integer reduction after draft
+    if factor >= 2 and image.mode not in ("P", "1"):
+        image = image.reduce(factor)
+
+    if crop_box:  # Map the box to the decoded resolution
+        sx, sy = image.width / orig_w, image.height / orig_h
+        image = image.crop((int(crop_box[0] * sx), int(crop_box[1] * sy),
+                            round(crop_box[2] * sx), round(crop_box[3] * sy)))
+    return image
+
+
+def load_img_bounded(path, max_bytes: Optional[int] = None, target_size: Optional[int] = None,
+                     crop_box: Optional[Tuple[int, int, int, int]] = None, frame: Optional[FrameSelector] = None):
+    """Decode an image at the lowest resolution that is good enough, within a memory budget.
+
+    The decoded size is estimated from the header before any pixel data is read. target_size is the largest edge
+    needed downstream (e.g. 256 for icons), crop_box is in original image coordinates. JPEGs are decoded at reduced
+    scale via draft(), other formats are reduced after decoding. If the source can not be decoded within max_bytes
+    a MemoryBudgetExceeded error is raised before decoding. frame selects the frame of animated sources, see
+    frames.select_frame. Always returns a new image.
+    """
     image = Image.open(path)
+    orig_size = image.size
+    animated_frame = frame is not None and frame_count(image) > 1
+    try:
+        scale = _decode_scale(path, image, max_bytes, target_size, crop_box, animated_frame)
+    except MemoryBudgetExceeded:
+        image.close()
+        raise
+
+    with stage("convert.decode", source=path, size=image.size):
+        if animated_frame:
+            image = select_frame(image, frame)
+        else:
+            image.load()
+
+    return _reduce_and_crop(image, orig_size, scale, crop_box)
+
+
+def iter_frames_bounded(path, indices: List[int], max_bytes: Optional[int] = None, target_size: Optional[int] = None,
+                        crop_box: Optional[Tuple[int, int, int, int]] = None) -> Iterator[Tuple[int, Image.Image]]:
+    """load_img_bounded for several frames of an animation, decoded in one forward pass. Yields (index, image).
+
+    Frames past the last one of the source are left out. A still source yields its only image as frame 0.
+    """
+    with Image.open(path) as image:
+        if frame_count(image) <= 1:
+            if 0 in indices:
+                yield 0, load_img_bounded(path, max_bytes=max_bytes, target_size=target_size, crop_box=crop_box)
+            return
+
+        orig_size = image.size
+        scale = _decode_scale(path, image, max_bytes, target_size, crop_box, animated_frame=True)
+        frames = iter_frames(image, indices)
+        while True:
+            with stage("convert.decode", source=path, size=orig_size):
+                item = next(frames, None)
+            if item is None:
+                return
+            index, frame = item
+            yield index, _reduce_and_crop(frame, orig_size, scale, crop_box)
+
+
+def _exif_thumbnail(image, target_size):
+    """Embedded EXIF thumbnail of a JPEG if it is at least target_size and has the same aspect ratio, else None."""
+    if image.format != "JPEG" or "exif" not in image.info:
+        return None
+
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(ExifTags.Base.JpegIFOffset), ifd1.get(ExifTags.Base.JpegIFByteCount)
+        if not offset or not length:
+            return None
+        # Offsets are relative to the TIFF header, which follows the 6 byte "Exif\0\0" prefix
+        data = image.info["exif"][6 + offset:6 + offset + length]
+        thumb = Image.open(io.BytesIO(data))
+        thumb.load()
+    except Exception:
+        return None
+
+    if thumb.width < target_size[0] or thumb.height < target_size[1]:
+        return None
+    if abs(thumb.width / thumb.height - image.width / image.height) > 0.02:  # Padded or rotated thumbnail
+        return None
+
+    return thumb
+
+
+def reduced_decode(image, target_size):
+    """Decode the image at the lowest resolution that is still at least target_size.
+
+    Uses the EXIF thumbnail if it is big enough, JPEG draft mode (DCT scaling during decode) and reduce() for
+    large integer factors. The result still needs a final resize to the exact target size.
+    """
+    thumb = _exif_thumbnail(image, target_size)
+    if thumb is not None:
+        return thumb
+
+    if image.format == "JPEG":
+        image.draft(image.mode, target_size)  # Only changes the decoder scale, keeps mode
+
+    factor = min(image.width // target_size[0], image.height // target_size[1])
+    if factor >= 2 and image.mode not in ("P", "1"):  # Palette images can not be averaged
+        image = image.reduce(factor)
+
+    return image
+
+
+def load_img(path, set_size: Optional[int], fast_preview: bool = True, frame: Optional[FrameSelector] = None):
+    image = Image.open(path)
+
+    if frame is not None and frame_count(image) > 1:  # Animated source, decode only the selected frame
+        image = select_frame(image, frame)
 
     if set_size:
         width, height = image.size
@@ -65,20 +344,28 @@ def load_img(path, set_size: Optional[int]):
             new_width, new_height = round((width / height) * set_size), set_size
         else:
             new_width, new_height = set_size, round((height / width) * set_size)
+        if fast_preview:
+            image = reduced_decode(image, (max(1, new_width), max(1, new_height)))
         image = image.resize((new_width, new_height))
 
     return image
 
 
-def create_checkerboard_pattern(width, height, square_size=10, color1=(225, 225, 225), color2=(255, 255, 255)):
+@lru_cache(maxsize=16)
+def _checkerboard(width, height, square_size, color1, color2):
+    # One 2x2 cell tile, tiled over the image with a few pastes instead of per pixel writes
+    tile = Image.new("RGB", (square_size * 2, square_size * 2), color1)
+    tile.paste(color2, (0, 0, square_size, square_size))
+    tile.paste(color2, (square_size, square_size, square_size * 2, square_size * 2))
 
     img = Image.new("RGB", (width, height), color1)
-    for y in range(0, height, square_size):
-        for x in range(0, width, square_size):
-            if (x // square_size + y // square_size) % 2 == 0:
-                for i in range(square_size):
-                    for j in range(square_size):
-                        if x + i < width and y + j < height:
-                            img.putpixel((x + i, y + j), color2)
-
-    return img
\ No newline at end of file
+    for y in range(0, height, tile.height):
+        for x in range(0, width, tile.width):
+            img.paste(tile, (x, y))
+
+    return img
+
+
+def create_checkerboard_pattern(width, height, square_size=10, color1=(225, 225, 225), color2=(255, 255, 255)):
+    """Checkerboard image to signal transparency. Results are memoized, callers get their own copy."""
+    return _checkerboard(width, height, square_size, tuple(color1), tuple(color2)).copy()
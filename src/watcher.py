@@ -0,0 +1,292 @@
+"""Watch folders and convert new or changed images as they land.
+
+Uses inotify on Linux (through ctypes, no extra dependency) and falls back to polling elsewhere. Files are only
+converted once their size and mtime stopped changing for `settle` seconds, so partially written files are skipped.
+With inotify, files that are still open for writing are held back as well. Outputs are written to a mirrored folder
+tree.
+"""
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from utils import VALID_IMG_TYPES
+from batch import ConvertJob, ConvertResult, run_job
+from ico_cache import IcoCache
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+def is_valid_img(path):
+    return path.split(".")[-1].lower() in VALID_IMG_TYPES
+
+
+def scan_files(roots: Iterable[str]) -> List[str]:
+    found = []
+    for root in roots:
+        for folder, _, files in os.walk(root):
+            found.extend(os.path.join(folder, name) for name in files)
+    return found
+
+
+class PollingWatcher:
+    """Detects changes by comparing size and mtime of all files between scans"""
+
+    def __init__(self, roots: Iterable[str], interval: float = 0.5):
+        self.roots = list(roots)
+        self.interval = interval
+        self._state = self._snapshot()
+        self._last_scan = time.monotonic()
+        self.writing = set()  # Polling can not tell whether a file is still open
+
+    def _snapshot(self) -> Dict[str, Tuple[int, float]]:
+        state = {}
+        for path in scan_files(self.roots):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state[path] = (stat.st_size, stat.st_mtime)
+        return state
+
+    def poll(self, timeout: float = 0.1) -> List[str]:
+        wait = self._last_scan + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self._last_scan + self.interval:
+                return []
+
+        state = self._snapshot()
+        self._last_scan = time.monotonic()
+        changed = [path for path, sig in state.items() if self._state.get(path) != sig]
+        self._state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Linux inotify watcher covering all subfolders of the roots, including ones created later"""
+
+    def __init__(self, roots: Iterable[str]):
+        self.roots = list(roots)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watches: Dict[int, str] = {}  # Watch descriptor -> folder
+        self.writing = set()  # Files modified but not closed yet
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _add_tree(self, root) -> List[str]:
+        """Watch root and all its subfolders. Returns the files already inside, they may have landed unseen."""
+        files = []
+        for folder, _, names in os.walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = folder
+            files.extend(os.path.join(folder, name) for name in names)
+        return files
+
+    def poll(self, timeout: float = 0.1) -> List[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:  # Events were dropped, treat everything as changed
+                return scan_files(self.roots)
+
+            folder = self._watches.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.extend(self._add_tree(path))
+                continue
+
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.writing.discard(path)
+            elif mask & (IN_CREATE | IN_MODIFY):
+                self.writing.add(path)
+            changed.append(path)
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_watcher(roots: Iterable[str], poll_interval: float = 0.5):
+    """inotify watcher on Linux, polling watcher where inotify is not available"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):  # AttributeError if libc has no inotify functions
+            pass
+    return PollingWatcher(roots, interval=poll_interval)
+
+
+class Debouncer:
+    """Holds back paths until their size and mtime stayed the same for settle seconds.
+
+    Paths in busy (still open for writing) are held back until they stayed the same for max_wait seconds, in case
+    the writer never closes them.
+    """
+
+    def __init__(self, settle: float = 0.3, max_wait: float = 30.0):
+        self.settle = settle
+        self.max_wait = max_wait
+        self._pending: Dict[str, Tuple[Tuple[int, float], float]] = {}  # path -> (signature, stable since)
+
+    def touch(self, paths: Iterable[str]):
+        now = time.monotonic()
+        for path in paths:
+            self._pending[path] = (None, now)
+
+    def ready(self, busy: Iterable[str] = ()) -> List[str]:
+        now = time.monotonic()
+        done = []
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:  # Deleted or moved away again
+                del self._pending[path]
+                continue
+
+            current = (stat.st_size, stat.st_mtime)
+            if current != signature:
+                self._pending[path] = (current, now)
+            elif now - since >= (self.max_wait if path in busy else self.settle):
+                del self._pending[path]
+                done.append(path)
+        return done
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def mirrored_output(src_path, root, out_dir: Optional[str]) -> str:
+    """Output path of src_path below out_dir, keeping its folder structure relative to root"""
+    rel = os.path.relpath(src_path, root)
+    base = os.path.join(out_dir, rel) if out_dir else src_path
+    return os.path.splitext(base)[0] + ".ico"
+
+
+def watch(roots: List[str], out_dir: Optional[str] = None, sizes: Optional[List[int]] = None,
+          max_workers: Optional[int] = None, settle: float = 0.3, initial_scan: bool = True,
+          on_result: Optional[Callable[[ConvertResult], None]] = None, stop: Optional[threading.Event] = None,
+          cache_max_bytes: Optional[int] = None, evict_interval: float = 60.0, **job_options):
+    """Convert new and changed images below roots until stop is set (or forever).
+
+    With initial_scan, existing images without an up to date output are converted first. job_options are passed
+    to every ConvertJob (cache_dir, max_bytes, frame, optimize, ...). With a cache_dir, the cache is evicted down
+    to cache_max_bytes at most every evict_interval seconds while conversions happen, and once when stopping.
+    """
+    roots = [os.path.abspath(root) for root in roots]
+    out_dir = os.path.abspath(out_dir) if out_dir else None
+    stop = stop or threading.Event()
+
+    def root_of(path):
+        return max((r for r in roots if path.startswith(r + os.sep)), key=len, default=None)
+
+    def wanted(path):
+        if not is_valid_img(path) or root_of(path) is None:
+            return False
+        return not (out_dir and path.startswith(out_dir + os.sep))
+
+    watcher = make_watcher(roots)
+    debouncer = Debouncer(settle)
+    running: Dict[Future, ConvertJob] = {}
+    in_flight: Dict[str, Future] = {}  # Source path -> its running conversion
+    changed_while_running = set()  # Converted again once the running job finished
+
+    cache = None
+    if job_options.get("cache_dir"):
+        cache = IcoCache(job_options["cache_dir"])
+        if cache_max_bytes is not None:
+            cache.max_bytes = cache_max_bytes
+    cache_grew = False  # Jobs finished since the last eviction
+    last_evict = time.monotonic()
+
+    if initial_scan:
+        for path in scan_files(roots):
+            output = mirrored_output(path, root_of(path), out_dir)
+            if wanted(path) and (not os.path.exists(output) or os.path.getmtime(output) < os.path.getmtime(path)):
+                debouncer.touch([path])
+
+    # Spawned workers, forking while watch() runs in a thread of a larger process can deadlock, see convert_batch
+    spawn = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn)
+    try:
+        while not stop.is_set():
+            debouncer.touch(p for p in watcher.poll(timeout=0.1) if wanted(p))
+
+            for path in debouncer.ready(busy=watcher.writing):
+                if path in in_flight:  # Two jobs writing the same output would race
+                    changed_while_running.add(path)
+                    continue
+                output = mirrored_output(path, root_of(path), out_dir)
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                job = ConvertJob(path, output, sizes=sizes, **job_options)
+                future = executor.submit(run_job, job)
+                running[future] = job
+                in_flight[path] = future
+
+            broken = False
+            for future in [f for f in running if f.done()]:
+                job = running.pop(future)
+                del in_flight[job.src_path]
+                if job.src_path in changed_while_running:
+                    changed_while_running.discard(job.src_path)
+                    debouncer.touch([job.src_path])
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:  # A worker died, e.g. killed for running out of memory
+                    result = ConvertResult(job, False, error=f"{type(e).__name__}: {e}")
+                    broken = True
+                cache_grew = True
+                if on_result is not None:
+                    on_result(result)
+
+            if cache is not None and cache_grew and time.monotonic() - last_evict >= evict_interval:
+                cache.evict()  # Scans the whole cache, so not after every job
+                cache_grew = False
+                last_evict = time.monotonic()
+
+            if broken:  # All jobs of a broken pool fail, they are reported as done in the next round
+                executor.shutdown()
+                executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn)
+    finally:
+        executor.shutdown()
+        watcher.close()
+        if cache is not None and cache_grew:
+            cache.evict()